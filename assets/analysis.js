@@ -0,0 +1,80 @@
+// Clientside callbacks of the Analysis tab
+
+(function() {
+    const TYPED_ARRAYS = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array,
+    };
+
+    // Decoded arrays keyed by the encoded {dtype, bdata} object. A patch
+    // that replaces a trace's data creates a new object, so each figure
+    // revision is decoded once however often the cursor moves.
+    const decodedArrays = new WeakMap();
+
+    function decodeArray(a) {
+        if (a === null || typeof a !== "object") {
+            return [];
+        }
+        if (Array.isArray(a) || ArrayBuffer.isView(a)) {
+            return a;
+        }
+        let decoded = decodedArrays.get(a);
+        if (decoded === undefined) {
+            const bin = atob(a.bdata);
+            const bytes = new Uint8Array(bin.length);
+            for (let i = 0; i < bin.length; i++) {
+                bytes[i] = bin.charCodeAt(i);
+            }
+            decoded = new TYPED_ARRAYS[a.dtype](bytes.buffer);
+            decodedArrays.set(a, decoded);
+        }
+        return decoded;
+    }
+
+    // Index of the last sample at or before t (zero-order hold), -1 if none
+    function sampleIndexAt(xs, t) {
+        let lo = 0;
+        let hi = xs.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (xs[mid] <= t) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo - 1;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        analysis: {
+            move_cursor: function(cursor_time, figure) {
+                const traces = (figure && figure.data) || [];
+                // The first half of the shapes are the event lines, the
+                // second half the cursor lines (one per subplot)
+                const shapes = (figure && figure.layout.shapes) || [];
+                const n_subplots = shapes.length / 2;
+                // Same wire format as dash.Patch, so only the cursor shapes
+                // are sent to the graph instead of a copy of the figure
+                const operations = [];
+                for (let i = n_subplots; i < shapes.length; i++) {
+                    operations.push(
+                        {operation: "Assign", location: ["layout", "shapes", i, "x0"], params: {value: cursor_time}},
+                        {operation: "Assign", location: ["layout", "shapes", i, "x1"], params: {value: cursor_time}},
+                        {operation: "Assign", location: ["layout", "shapes", i, "visible"], params: {value: true}},
+                    );
+                }
+                const readouts = [];
+                for (const trace of traces) {
+                    const xs = decodeArray(trace.x);
+                    const ys = decodeArray(trace.y);
+                    const idx = sampleIndexAt(xs, cursor_time);
+                    const value = idx < 0 ? "--" : Number(ys[idx]).toPrecision(6);
+                    readouts.push(`${trace.name}: ${value}`);
+                }
+                const patch = {__dash_patch_update: "__dash_patch_update", operations: operations};
+                return [patch].concat(readouts);
+            },
+        },
+    });
+})();
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Builds the columnar cache (build_columnar_copy in matsignals.py) for
+# every mat file of a job folder ahead of time, instead of on first access,
+# and optionally compares window read latency of the mat files and the cache.
+#
+#   python convert_columnar.py JOB|DIR [--workers N] [--force] [--bench N]
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import matsignals as ms
+
+def convert(mat_path:str, force:bool) -> dict:
+    # Runs in a worker process
+    t0 = time.perf_counter()
+    result = {"mat_path": mat_path, "error": None, "skipped": None}
+    try:
+        path = None if force else ms.find_columnar_copy(mat_path)
+        if path is None:
+            path = ms.build_columnar_copy(mat_path)
+            if path is None and os.path.getsize(mat_path) > ms.CONF.columnar_cache_bytes:
+                result["skipped"] = "larger than the columnar cache budget"
+            elif path is None:
+                result["skipped"] = "contiguous and uncompressed, read memory-mapped"
+        else:
+            result["skipped"] = "up to date"
+        result["in_bytes"] = os.path.getsize(mat_path)
+        result["out_bytes"] = os.path.getsize(path) if path else 0
+    except Exception as e:
+        result["error"] = repr(e)
+    result["sec"] = time.perf_counter() - t0
+    return result
+
+def time_windows(path:str, windows:list[tuple[float,float]]) -> np.ndarray:
+    # ms per window, all 1-D datasets of all port groups
+    with ms.g_h5pool.open(path) as h5obj:
+        meta = ms.g_mat_meta.get(h5obj)
+        channels = {gname: [name for name, d in gmeta["datasets"].items()
+                            if name != "time" and d["shape"] == [gmeta["count"]]]
+                    for gname, gmeta in meta["groups"].items()}
+        latency = []
+        for stime, etime in windows:
+            t0 = time.perf_counter()
+            for gname, names in channels.items():
+                ms.read_window(h5obj, gname, stime, etime, names)
+            latency.append((time.perf_counter() - t0) * 1000.0)
+    return np.array(latency)
+
+def benchmark(mat_paths:list[str], n:int):
+    rng = np.random.default_rng(0)
+    before, after = ms.CONF.signal_window_before_sec, ms.CONF.signal_window_after_sec
+    src_all, cache_all = [], []
+    for mat_path in mat_paths:
+        cache_path = ms.find_columnar_copy(mat_path)
+        if cache_path is None:
+            continue
+        with ms.g_h5pool.open(mat_path) as h5obj:
+            tmin, tmax = ms.get_dat_min_max_time(h5obj)
+        dats = rng.uniform(tmin + before, tmax - after, n)
+        windows = [(dat - before, dat + after) for dat in dats]
+        src = time_windows(mat_path, windows)
+        cache = time_windows(cache_path, windows)
+        src_all.append(src)
+        cache_all.append(cache)
+        print(f"  {os.path.basename(mat_path)}: mat {np.median(src):.2f} ms, cache {np.median(cache):.2f} ms (median)")
+    if not src_all:
+        return
+    src, cache = np.concatenate(src_all), np.concatenate(cache_all)
+    print(f"window read latency over {len(src)} windows of {before + after:g} s:")
+    for label, a in (("mat", src), ("cache", cache)):
+        print(f"  {label:6s} median {np.median(a):7.2f} ms  p95 {np.percentile(a, 95):7.2f} ms  max {a.max():7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar cache of the mat files of a job.")
+    parser.add_argument("job", help=f"job number (folder under {ms.CONF.mat_server_dir}) or folder path")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="rebuild up-to-date copies too")
+    parser.add_argument("--bench", type=int, default=0, metavar="N", help="time N random windows per file")
+    args = parser.parse_args()
+
+    mat_dir = args.job if os.path.isdir(args.job) else f"{ms.CONF.mat_server_dir}/{args.job}"
+    if not os.path.isdir(mat_dir):
+        parser.error(f"Directory does not exist: {mat_dir}")
+    mat_paths = sorted(f"{mat_dir}/{f}" for f in os.listdir(mat_dir) if f.endswith(".mat"))
+    print(f"{len(mat_paths)} mat files in {mat_dir}, cache in {ms.CONF.cache_dir}/columnar"
+          f", {'blosc/lz4' if ms.hdf5plugin is not None else 'lzf'}")
+
+    t0 = time.perf_counter()
+    in_bytes = 0
+    failed = 0
+    # spawn, not fork: HDF5 library state is not fork-safe
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=ctx) as executor:
+        futures = [executor.submit(convert, path, args.force) for path in mat_paths]
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            r = future.result()
+            name = os.path.basename(r["mat_path"])
+            if r["error"] is not None:
+                failed += 1
+                print(f"[{i}/{len(futures)}] {name}: {r['error']}")
+                continue
+            if r["skipped"]:
+                print(f"[{i}/{len(futures)}] {name}: {r['skipped']}")
+                continue
+            in_bytes += r["in_bytes"]
+            print(f"[{i}/{len(futures)}] {name}: {r['in_bytes'] / 1e6:.1f} MB -> {r['out_bytes'] / 1e6:.1f} MB"
+                  f" in {r['sec']:.1f} s", flush=True)
+    elapsed = time.perf_counter() - t0
+    print(f"converted {in_bytes / 1e6:.1f} MB in {elapsed:.1f} s ({in_bytes / elapsed / 1e6:.1f} MB/s)")
+
+    if args.bench:
+        benchmark(mat_paths, args.bench)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
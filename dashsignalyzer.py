@@ -2,22 +2,40 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import collections
+import concurrent.futures
+import contextlib
 import dataclasses
-import glob
+import functools
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+import warnings
 import cv2
 import numpy as np
-import pandas as pd
 #from scipy.io import loadmat
 import h5py
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
+import flask
 import dash
-from dash import html, dcc, callback, Input, Output, State, callback_context, dash_table
+from dash import html, dcc, callback, Input, Output, State, callback_context, dash_table, ClientsideFunction
 import dash_bootstrap_components as dbc
 import os
-
-g_script_dir = os.path.dirname(os.path.abspath(__file__))
+import resampling
+from matsignals import (
+    CONF, ImageEncoding, g_ac, g_h5pool, g_mat_meta, g_dataset_mapper, g_local_files, g_pyramid_builder,
+    g_columnar_builder, g_columnar_budget, g_channel_conf, g_expr_cache, ByteLRUCache, get_file_stamp,
+    resolve_local_copy, read_window, trim_window, read_overview, open_signal_file, is_channel_path,
+    get_channel_refs, get_expression_margin, read_operand_windows, get_expr_cache_key,
+    evaluate_derived_channel, read_channel_window, load_event_list, get_mat_path, get_event_window,
+    get_dat_min_max_time, get_path_key, atomic_write,
+)
 
 THEMES = {
     "CERULEAN": dbc.themes.CERULEAN,
@@ -35,75 +53,216 @@ default_external_stylesheets = [THEMES["CERULEAN"]]
 #     if not name.startswith("_") and isinstance(value, str)
 # }
 
-@dataclasses.dataclass
-class Config:
-    event_list_path:str
-    mat_server_dir:str
-    avi_dir:str
-
-CONF = Config(
-    event_list_path="./event-list.xlsx",
-    mat_server_dir=f"{g_script_dir}/server-out",
-    avi_dir=f"{g_script_dir}/avi"
-)
+def downsample_minmax(y:np.ndarray, n_out:int) -> np.ndarray:
+    # Indices of the minimum and maximum of each of n_out/2 equal buckets
+    n = len(y)
+    size = -(-n // max(1, n_out // 2))
+    n_buckets = -(-n // size)
+    yf = y.astype(np.float64, copy=False)
+    pad = n_buckets * size - n
+    lo = np.concatenate([np.where(np.isnan(yf), np.inf, yf), np.full(pad, np.inf)]).reshape(n_buckets, size)
+    hi = np.concatenate([np.where(np.isnan(yf), -np.inf, yf), np.full(pad, -np.inf)]).reshape(n_buckets, size)
+    base = np.arange(n_buckets) * size
+    idx = np.concatenate([base + lo.argmin(axis=1), base + hi.argmax(axis=1)])
+    return np.unique(idx)
 
-@dataclasses.dataclass
-class AppContext:
-    mat_dir:str
+def downsample_lttb(x:np.ndarray, y:np.ndarray, n_out:int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets. Buckets depend on the previously
+    # selected point, so only the work inside a bucket is vectorized.
+    n = len(x)
+    if n_out < 3 or n <= n_out:
+        return np.arange(n)
+    xf = x.astype(np.float64, copy=False)
+    yf = y.astype(np.float64, copy=False)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, np.int64)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        s, e = edges[i], edges[i+1]
+        ns, ne = e, edges[i+2] if i + 2 < len(edges) else n
+        cx = xf[ns:ne].mean()
+        cy = yf[ns:ne].mean()
+        area = np.abs((xf[a] - cx) * (yf[s:e] - yf[a]) - (xf[a] - xf[s:e]) * (cy - yf[a]))
+        a = s + int(np.nanargmax(area)) if not np.all(np.isnan(area)) else s
+        idx[i+1] = a
+    return idx
 
-g_ac = AppContext(mat_dir=f"{CONF.mat_server_dir}/11000")
-
-def get_signal_by_path(d, path:str):
-    keys = path.split(".")
-    v = d
-    for k in keys:
-        v = v[k]
-    return v
+def downsample_trace(x:np.ndarray, y:np.ndarray, budget:int, mode:str, keep_x:float|None=None) -> tuple[np.ndarray,np.ndarray,bool]:
+    # Reduces a trace to about budget points. The sample in effect at keep_x
+    # is always kept. Returns the arrays and whether they were reduced.
+    if mode == "none" or len(x) <= budget:
+        return x, y, False
+    if mode == "lttb":
+        idx = downsample_lttb(x, y, budget)
+    elif mode == "minmax":
+        idx = downsample_minmax(y, budget)
+    else:
+        raise ValueError(f"Unknown downsample mode: {mode}")
+    if keep_x is not None:
+        k = int(np.searchsorted(x, keep_x, side="right")) - 1
+        if 0 <= k < len(x):
+            idx = np.union1d(idx, [k])
+    return x[idx], y[idx], True
 
-def get_index_range(time:np.ndarray, stime:float, etime:float) -> range:
-    sidx = np.searchsorted(time, stime)
-    eidx = np.searchsorted(time, etime)
-    return range(sidx, eidx)
+def generate_signal_trace(x:np.ndarray, y:np.ndarray, event_time:float) -> dict:
+    # Markers are only drawn when every sample is shown
+    x, y, reduced = downsample_trace(x, y, CONF.trace_point_budget, CONF.downsample_mode, event_time)
+    return {"x": x, "y": y, "mode": "lines" if reduced else "lines+markers"}
 
 def generate_empty_figure() -> go.Figure:
-    subplot_titles = [
-        "port1.dx",
-        "port2.c1",
-    ]
-    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, subplot_titles=subplot_titles, vertical_spacing=0.05)
+    subplot_titles = [sp.title for sp in g_channel_conf.subplots]
+    fig = make_subplots(rows=g_channel_conf.rows, cols=g_channel_conf.cols, shared_xaxes="all",
+                        subplot_titles=subplot_titles, vertical_spacing=0.05)
     return fig
 
-def generate_signal_figure(mat:h5py.File, event_time:float):
-    stime = event_time - 3.0
-    etime = event_time + 2.0
-
-    port1_time = get_signal_by_path(mat, "port1.time")
-    port1_dx = get_signal_by_path(mat, "port1.dx")
-    port1_dy = get_signal_by_path(mat, "port1.dy")
-    port1_r = get_index_range(port1_time, stime, etime)
+def generate_signal_traces(mat:h5py.File, stime:float, etime:float, event_time:float) -> list[dict]:
+    # Channels of the same group share its time dataset, so each group's
+    # window is located once and read in one read_window call. Derived
+    # channels are taken from the expression cache when possible.
+    channels = g_channel_conf.channels()
+    derived = {}
+    for channel in channels:
+        if not is_channel_path(channel):
+            derived[channel] = g_expr_cache.get(get_expr_cache_key(mat, channel, stime, etime))
+    groups:dict[str,list[str]] = {}
+    padded = set()  # groups read by expressions, with margin
+    margin = 0.0
+    for channel in channels:
+        if derived.get(channel) is not None:
+            continue
+        if channel in derived:
+            margin = max(margin, get_expression_margin(channel))
+        for ref in get_channel_refs(channel):
+            gname, name = ref.rsplit(".", 1)
+            names = groups.setdefault(gname, [])
+            if name not in names:
+                names.append(name)
+            if channel in derived:
+                padded.add(gname)
+    windows = read_operand_windows(mat, {gname: groups[gname] for gname in padded}, stime, etime, margin)
+    windows.update({gname: read_window(mat, gname, stime, etime, names)
+                    for gname, names in groups.items() if gname not in padded})
+    traces = []
+    for channel in channels:
+        if channel in derived:
+            s = derived[channel] or evaluate_derived_channel(mat, channel, windows, stime, etime)
+            traces.append(generate_signal_trace(s.time, s.values, event_time))
+        else:
+            gname, name = channel.rsplit(".", 1)
+            t, v = windows[gname]["time"], windows[gname][name]
+            if gname in padded:
+                t, v = trim_window(t, v, stime, etime)
+            traces.append(generate_signal_trace(t, v, event_time))
+    return traces
 
-    port2_time = get_signal_by_path(mat, "port2.time")
-    port2_c0 = get_signal_by_path(mat, "port2.c0")
-    port2_c1 = get_signal_by_path(mat, "port2.c1")
-    port2_r = get_index_range(port2_time, stime, etime)
+def generate_overview_traces(mat_path:str, stime:float, etime:float) -> list[dict]|None:
+    # Min/max envelopes from the pyramid, drawn as one zigzag line per channel
+    width = CONF.trace_point_budget // 2
+    traces = []
+    for channel in g_channel_conf.channels():
+        # Derived channels have no pyramid
+        ov = read_overview(mat_path, channel, stime, etime, width) if is_channel_path(channel) else None
+        if ov is None:
+            return None
+        x = np.repeat(ov["time"], 2)
+        y = np.column_stack([ov["min"], ov["max"]]).ravel()
+        traces.append({"x": x, "y": y, "mode": "lines"})
+    return traces
 
+def generate_figure_skeleton() -> go.Figure:
+    # Subplots, axes, one empty trace per channel and a hidden event line
+    # per subplot. Built once for the layout; events only patch it
+    # (patch_signal_figure).
     fig = generate_empty_figure()
-    row=0; col=0
 
-    col+=1
-    row+=1
-    fig.add_trace(go.Scatter(x=port1_time[port1_r], y=port1_dx[port1_r], mode="lines+markers"), row=row, col=col)
-    fig.add_vline(x=event_time, line_dash="dot", row=row, col=col)
+    # x is the time from the event, so the event line stays at 0. With n
+    # subplots, shapes 0..n-1 are the event lines and n..2n-1 the cursor
+    # lines moved by assets/analysis.js.
+    for i, sp in enumerate(g_channel_conf.subplots):
+        row, col = g_channel_conf.cell(i)
+        for channel in sp.channels:
+            fig.add_trace(go.Scatter(x=[], y=[], mode="lines", name=channel), row=row, col=col)
+        fig.add_vline(x=0, line_dash="dot", visible=False, row=row, col=col)
+    for i in range(len(g_channel_conf.subplots)):
+        row, col = g_channel_conf.cell(i)
+        fig.add_vline(x=0, line_color="firebrick", line_width=1, visible=False, row=row, col=col)
+    fig.update_xaxes(title_text="Time from event [s]", row=g_channel_conf.rows)
+    fig.update_layout(showlegend=any(len(sp.channels) > 1 for sp in g_channel_conf.subplots))
 
-    row+=1
-    fig.add_trace(go.Scatter(x=port2_time[port2_r], y=port2_c1[port2_r], mode="lines+markers"), row=row, col=col)
-    fig.add_vline(x=event_time, line_dash="dot", row=row, col=col)
-
-    fig.update_layout(dragmode=False)
+    if CONF.signal_zoom:
+        # x-only zoom. uirevision keeps the zoom while zoom_signal_figure
+        # replaces the trace data, and is changed for every event.
+        fig.update_layout(dragmode="zoom")
+        fig.update_yaxes(fixedrange=True)
+    else:
+        fig.update_layout(dragmode=False)
 
     return fig
 
-g_evlist_df = pd.read_excel(CONF.event_list_path)
+def encode_typed_array(a:np.ndarray, tolerance:float|None) -> dict:
+    # Plotly typed array spec. Floats are sent as float32 when the
+    # transport allows it and the conversion error is within tolerance.
+    if a.dtype.kind in "iub" and a.dtype.itemsize <= 4:
+        out = a.astype(a.dtype.newbyteorder("<") if a.dtype.kind != "b" else "u1", copy=False)
+    else:
+        out = a.astype("<f8", copy=False)
+        if CONF.figure_transport == "float32" and tolerance is not None:
+            out32 = out.astype("<f4")
+            with np.errstate(invalid="ignore", over="ignore"):
+                err = np.max(np.abs(out32 - out), initial=0.0, where=np.isfinite(out))
+            if err <= tolerance:
+                out = out32
+    return {"dtype": out.dtype.str[1:], "bdata": base64.b64encode(out.tobytes()).decode("ascii")}
+
+def encode_signal_traces(traces:list[dict], event_time:float) -> tuple[list[dict],int]:
+    # Converts x to the time from the event and encodes x/y for transport.
+    # Returns the encoded traces and their payload size in bytes.
+    encoded = []
+    nbytes = 0
+    for trace in traces:
+        x = trace["x"] - event_time
+        y = trace["y"]
+        if CONF.figure_transport == "json":
+            ex = x.tolist()
+            ey = y.tolist()
+            nbytes += len(json.dumps(ex)) + len(json.dumps(ey))
+        else:
+            # Relative tolerance for float values only; np.ptp fails on bools
+            tolerance = None
+            if y.dtype.kind == "f":
+                finite = y[np.isfinite(y)]
+                tolerance = CONF.float32_value_rtol * float(np.ptp(finite)) if len(finite) else 0.0
+            ex = encode_typed_array(x, CONF.float32_time_tolerance_sec)
+            ey = encode_typed_array(y, tolerance)
+            nbytes += len(ex["bdata"]) + len(ey["bdata"])
+        encoded.append({"x": ex, "y": ey, "mode": trace["mode"]})
+    return encoded, nbytes
+
+def patch_signal_figure(traces:list[dict], new_event:bool=False) -> dash.Patch:
+    # traces as returned by encode_signal_traces
+    patched = dash.Patch()
+    for i, trace in enumerate(traces):
+        patched["data"][i]["x"] = trace["x"]
+        patched["data"][i]["y"] = trace["y"]
+        patched["data"][i]["mode"] = trace["mode"]
+    if new_event:
+        for i in range(len(g_channel_conf.subplots)):
+            patched["layout"]["shapes"][i]["visible"] = True
+        patched["layout"]["uirevision"] = str(uuid.uuid4())
+    return patched
+
+def get_relayout_xrange(relayout:dict) -> tuple[float,float]|None:
+    for k, v in relayout.items():
+        m = re.fullmatch(r"(xaxis\d*)\.range\[0\]", k)
+        if m and f"{m.group(1)}.range[1]" in relayout:
+            return float(v), float(relayout[f"{m.group(1)}.range[1]"])
+        if re.fullmatch(r"xaxis\d*\.range", k):
+            return float(v[0]), float(v[1])
+    return None
+
+g_evlist_df = load_event_list(CONF.event_list_path)
 
 def generate_dummy_graph() -> go.Figure:
     df = px.data.iris()
@@ -111,66 +270,732 @@ def generate_dummy_graph() -> go.Figure:
     return fig
 fig = generate_dummy_graph()
 
+class VideoIndex:
+    # stem -> path of the video files in a directory. The directory is
+    # rescanned only when its mtime changes (i.e. files were added, removed
+    # or renamed). Lookups never wait for a scan: find() starts it in the
+    # background and answers from the last index meanwhile. When several
+    # files share a stem, the extension listed first in exts wins.
+    def __init__(self, video_dir:str, exts:tuple[str,...]):
+        self.video_dir = video_dir
+        self.exts = tuple(e.lower() for e in exts)
+        self.paths:dict[str,str] = {}
+        self.dir_mtime_ns:int|None = None
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="video-index")
+        self.scanning = False
+        self.scans = 0
+
+    def get_dir_mtime_ns(self) -> int|None:
+        try:
+            return os.stat(self.video_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force:bool=False):
+        # Scans now if the directory changed; lookups meanwhile use the
+        # previous index
+        mtime_ns = self.get_dir_mtime_ns()
+        if not force and mtime_ns == self.dir_mtime_ns:
+            return
+        paths = {}
+        ranks = {}
+        if mtime_ns is not None:
+            with os.scandir(self.video_dir) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    stem, ext = os.path.splitext(entry.name)
+                    ext = ext.lower()
+                    if ext not in self.exts:
+                        continue
+                    rank = self.exts.index(ext)
+                    if stem not in paths or rank < ranks[stem]:
+                        paths[stem] = f"{self.video_dir}/{entry.name}"
+                        ranks[stem] = rank
+        with self.lock:
+            self.paths = paths
+            self.dir_mtime_ns = mtime_ns
+            self.scans += 1
+
+    def _rescan(self):
+        try:
+            self.refresh()
+        except OSError as e:
+            print(f"video index: {e}")
+        finally:
+            with self.lock:
+                self.scanning = False
+
+    def find(self, stem:str) -> str|None:
+        mtime_ns = self.get_dir_mtime_ns()
+        with self.lock:
+            if mtime_ns != self.dir_mtime_ns and not self.scanning:
+                self.scanning = True
+                self.executor.submit(self._rescan)
+            return self.paths.get(stem)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"dir": self.video_dir, "files": len(self.paths), "scans": self.scans, "scanning": self.scanning}
+
+g_video_index = VideoIndex(CONF.avi_dir, CONF.video_exts)
+g_video_index.refresh()
+
 def find_avi_from_filename(fname:str) -> str|None:
     stem = os.path.splitext(fname)[0]
-    for path in glob.glob(f"{CONF.avi_dir}/*"):
-        tmp_fname = os.path.split(path)[1]
-        tmp_stem = os.path.splitext(tmp_fname)[0]
-        if stem == tmp_stem:
-            return path
-    return None
-
-def get_dat_min_max_time(h5obj:h5py.File) -> tuple[float,float]:
-    max_time = -99999
-    min_time = 99999
-    for k in h5obj.keys():
-        if "time" in h5obj[k]:
-            tmp_min_time = h5obj[k]["time"][0]
-            tmp_max_time = h5obj[k]["time"][-1]
-            min_time = min(tmp_min_time, min_time)
-            max_time = max(tmp_max_time, max_time)
-    return min_time, max_time
+    return g_video_index.find(stem)
 
 def convert_to_avi_time(ev_dat_time:float, h5obj:h5py.File, avi_path:str) -> float:
     min_time, _ = get_dat_min_max_time(h5obj)
     avi_time = ev_dat_time - min_time
     return avi_time
 
+@dataclasses.dataclass
+class FrameTable:
+    pts:np.ndarray        # presentation time [s] of every frame
+    keyframes:np.ndarray  # sorted frame numbers of keyframes, empty if unknown
+
+    def frame_at(self, t:float) -> int:
+        idx = int(np.searchsorted(self.pts, t + 1e-6, side="right")) - 1
+        return min(max(idx, 0), len(self.pts) - 1)
+
+    def keyframe_before(self, idx:int) -> int|None:
+        i = int(np.searchsorted(self.keyframes, idx, side="right")) - 1
+        return int(self.keyframes[i]) if i >= 0 else None
+
+AVI_INDEX_DTYPE = np.dtype([("ckid", "S4"), ("flags", "<u4"), ("offset", "<u4"), ("size", "<u4")])
+AVIIF_KEYFRAME = 0x10
+
+def iter_riff_chunks(f, start:int, end:int):
+    # Yields (fourcc, data offset, data size) of the chunks in [start, end)
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return
+        size = int.from_bytes(hdr[4:8], "little")
+        yield hdr[:4], pos + 8, size
+        pos += 8 + size + (size & 1)
+
+def parse_avi_frame_table(path:str) -> FrameTable|None:
+    # Reads frame timing and keyframe flags of the first video stream from
+    # the AVI index (OpenDML indx/ix## or legacy idx1) without decoding.
+    with open(path, "rb") as f:
+        hdr = f.read(12)
+        if len(hdr) < 12 or hdr[:4] != b"RIFF" or hdr[8:12] != b"AVI ":
+            return None
+        riff_end = 8 + int.from_bytes(hdr[4:8], "little")
+        stream_no = None
+        scale = rate = start = 0
+        super_index = None
+        idx1 = None
+        for fcc, off, size in iter_riff_chunks(f, 12, riff_end):
+            if fcc == b"LIST":
+                f.seek(off)
+                if f.read(4) != b"hdrl":
+                    continue
+                n_streams = 0
+                for sfcc, soff, ssize in iter_riff_chunks(f, off + 4, off + size):
+                    f.seek(soff)
+                    if sfcc != b"LIST" or f.read(4) != b"strl":
+                        continue
+                    for cfcc, coff, csize in iter_riff_chunks(f, soff + 4, soff + ssize):
+                        f.seek(coff)
+                        data = f.read(csize)
+                        if cfcc == b"strh" and stream_no is None and data[:4] == b"vids":
+                            stream_no = n_streams
+                            scale, rate, start = (int.from_bytes(data[i:i+4], "little") for i in (20, 24, 28))
+                        elif cfcc == b"indx" and stream_no == n_streams and data[3] == 0x00:
+                            n = int.from_bytes(data[4:8], "little")
+                            super_index = [int.from_bytes(data[24+16*i:32+16*i], "little") for i in range(n)]
+                    n_streams += 1
+            elif fcc == b"idx1":
+                f.seek(off)
+                idx1 = np.frombuffer(f.read(size - size % 16), dtype=AVI_INDEX_DTYPE)
+        if stream_no is None or scale == 0 or rate == 0:
+            return None
+
+        if super_index:
+            keyflags = []
+            for ix_off in super_index:
+                f.seek(ix_off)
+                ix = f.read(32)
+                n = int.from_bytes(ix[12:16], "little")
+                entries = np.frombuffer(f.read(8 * n), dtype="<u4").reshape(-1, 2)
+                keyflags.append((entries[:, 1] & 0x80000000) == 0)
+            is_key = np.concatenate(keyflags) if keyflags else np.zeros(0, bool)
+        elif idx1 is not None:
+            prefix = f"{stream_no:02d}".encode()
+            ckid = idx1["ckid"]
+            mask = np.char.startswith(ckid, prefix) & (np.char.endswith(ckid, b"dc") | np.char.endswith(ckid, b"db"))
+            is_key = (idx1["flags"][mask] & AVIIF_KEYFRAME) != 0
+        else:
+            return None
+
+    pts = (start + np.arange(len(is_key))) * (scale / rate)
+    return FrameTable(pts=pts, keyframes=np.flatnonzero(is_key))
+
+def load_frame_table(path:str, stamp:tuple[int,int], cap:cv2.VideoCapture) -> FrameTable:
+    # Frame tables are cached in CONF.cache_dir, keyed by path and stamp.
+    # Containers other than AVI get a table computed from the frame rate
+    # with unknown keyframes.
+    cache_path = f"{CONF.cache_dir}/frame-index/{get_path_key(path)}.npz"
+    try:
+        with np.load(cache_path) as z:
+            if tuple(z["stamp"]) == stamp:
+                return FrameTable(pts=z["pts"], keyframes=z["keyframes"])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    try:
+        table = parse_avi_frame_table(path)
+    except (OSError, ValueError, IndexError) as e:
+        print(f"frame index: {path}: {e}")
+        table = None
+    if table is None:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        pts = np.arange(n) / fps if fps > 0 and n > 0 else np.zeros(0)
+        table = FrameTable(pts=pts, keyframes=np.zeros(0, np.int64))
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with atomic_write(cache_path) as tmp_path, open(tmp_path, "wb") as f:
+            np.savez(f, stamp=np.array(stamp, np.int64), pts=table.pts, keyframes=table.keyframes)
+    except OSError as e:
+        print(f"frame index: {e}")
+    return table
+
+class PooledCapture:
+    # A cv2.VideoCapture that remembers which frame it returns next. A frame
+    # is reached by seeking to the preceding keyframe and decoding forward,
+    # unless the capture is already between that keyframe and the frame.
+    # Without keyframe information, reading the same or a slightly later
+    # frame decodes forward and anything else seeks.
+    MAX_FORWARD_FRAMES = 30
+
+    def __init__(self, path:str, stamp:tuple[int,int]):
+        self.path = path
+        self.stamp = stamp
+        self.cap = cv2.VideoCapture(path)
+        self.table:FrameTable|None = None
+        self.pos = 0
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+
+    def frame_table(self) -> FrameTable:
+        if self.table is None:
+            self.table = load_frame_table(self.path, self.stamp, self.cap)
+        return self.table
+
+    def frame_index(self, t:float) -> int:
+        return self.frame_table().frame_at(t)
+
+    def read_frame(self, idx:int) -> np.ndarray|None:
+        key = self.frame_table().keyframe_before(idx)
+        if key is None:
+            if not 0 <= idx - self.pos <= self.MAX_FORWARD_FRAMES:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+                self.pos = idx
+        elif not key <= self.pos <= idx:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+            self.pos = key
+        while self.pos < idx:
+            if not self.cap.grab():
+                self.pos = -1
+                return None
+            self.pos += 1
+        ret, frame = self.cap.read()
+        if not ret:
+            self.pos = -1
+            return None
+        self.pos += 1
+        return frame
+
+class VideoCapturePool:
+    # Open captures keyed by path. A capture is released when it has not been
+    # used for idle_timeout seconds or when the file's mtime/size changes.
+    def __init__(self, idle_timeout:float):
+        self.idle_timeout = idle_timeout
+        self.entries:dict[str,PooledCapture] = {}
+        self.lock = threading.Lock()
+        self.sweeper:threading.Thread|None = None
+        self.hits = 0
+        self.misses = 0
+
+    @contextlib.contextmanager
+    def open(self, path:str):
+        stamp = get_file_stamp(path)
+        with self.lock:
+            vc = self.entries.get(path)
+            if vc is not None and vc.stamp == stamp:
+                self.hits += 1
+            else:
+                if vc is not None:
+                    self._release(self.entries.pop(path))
+                self.misses += 1
+                vc = PooledCapture(path, stamp)
+                self.entries[path] = vc
+            vc.users += 1
+            if self.sweeper is None:
+                self.sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+                self.sweeper.start()
+        try:
+            with vc.lock:
+                yield vc
+        finally:
+            with self.lock:
+                vc.users -= 1
+                vc.last_used = time.monotonic()
+                if self.entries.get(path) is not vc:
+                    self._release(vc)
+
+    def _release(self, vc:PooledCapture):
+        if vc.users == 0:
+            vc.cap.release()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            with self.lock:
+                for path, vc in list(self.entries.items()):
+                    if vc.users == 0 and now - vc.last_used > self.idle_timeout:
+                        self._release(self.entries.pop(path))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"open": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+g_capture_pool = VideoCapturePool(CONF.video_idle_timeout_sec)
+g_frame_cache = ByteLRUCache(CONF.frame_cache_bytes)
+
 def extract_still_image_as_ndarray(avi_path:str, avi_time_sec:float) -> np.ndarray:
-    cap = cv2.VideoCapture(avi_path)
-    if not cap.isOpened():
-        print("error1")
-        return False
+    with g_capture_pool.open(resolve_local_copy(avi_path)) as vc:
+        if not vc.cap.isOpened():
+            print("error1")
+            return False
 
-    cap.set(cv2.CAP_PROP_POS_MSEC, avi_time_sec*1000.0)
-    ret, frame = cap.read()
-    if not ret:
-        print("error2")
-        return False
+        if len(vc.frame_table().pts) == 0:
+            # Frame timing unknown: seek by time and bypass the frame cache
+            vc.cap.set(cv2.CAP_PROP_POS_MSEC, avi_time_sec*1000.0)
+            vc.pos = -1
+            ret, frame = vc.cap.read()
+            if not ret:
+                print("error2")
+                return False
+            return frame
 
+        idx = vc.frame_index(avi_time_sec)
+        key = (avi_path, vc.stamp, idx)
+        frame = g_frame_cache.get(key)
+        if frame is not None:
+            return frame
+        frame = vc.read_frame(idx)
+        if frame is None:
+            print("error2")
+            return False
+
+    # Cached frames are shared between requests
+    frame.flags.writeable = False
+    g_frame_cache.put(key, frame, frame.nbytes)
     return frame
 
-def extract_still_image_as_base64(avi_path:str, avi_time_sec:float) -> str:
+class EncodeStats:
+    def __init__(self):
+        self.views:dict[str,dict] = {}
+        self.lock = threading.Lock()
+
+    def add(self, view:str, nbytes:int, encode_ms:float):
+        with self.lock:
+            st = self.views.setdefault(view, {"count": 0, "bytes": 0, "encode_ms": 0.0})
+            st["count"] += 1
+            st["bytes"] += nbytes
+            st["encode_ms"] += encode_ms
+            st["last_bytes"] = nbytes
+            st["last_encode_ms"] = encode_ms
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {view: dict(st) for view, st in self.views.items()}
+
+g_image_cache = ByteLRUCache(CONF.image_cache_bytes)
+g_encode_stats = EncodeStats()
+g_figure_stats = EncodeStats()
+
+def encode_image(frame:np.ndarray, enc:ImageEncoding) -> bytes:
+    h, w = frame.shape[:2]
+    if enc.width and w > enc.width:
+        frame = cv2.resize(frame, (enc.width, max(1, round(h * enc.width / w))), interpolation=enc.interpolation)
+    if enc.fmt == "jpeg":
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, enc.quality])
+    elif enc.fmt == "webp":
+        ok, buffer = cv2.imencode(".webp", frame, [cv2.IMWRITE_WEBP_QUALITY, enc.quality])
+    elif enc.fmt == "png":
+        ok, buffer = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, enc.png_compression])
+    else:
+        raise ValueError(f"Unknown image format: {enc.fmt}")
+    if not ok:
+        raise ValueError(f"Failed to encode image as {enc.fmt}")
+    return buffer.tobytes()
+
+def encode_still_image(avi_path:str, avi_time_sec:float, view:str) -> tuple[bytes,float]|None:
+    # Returns the encoded image and the time it took to encode [ms]
+    key = (avi_path, get_file_stamp(avi_path), round(avi_time_sec, 6), view)
+    ent = g_image_cache.get(key)
+    if ent is not None:
+        return ent
     frame = extract_still_image_as_ndarray(avi_path, avi_time_sec)
-    _, buffer = cv2.imencode(".jpg", frame)
-    encoded = base64.b64encode(buffer).decode("ascii")
-    return "data:image/jpeg;base64," + encoded
+    if frame is False:
+        return None
+    t0 = time.perf_counter()
+    buf = encode_image(frame, CONF.image_encodings[view])
+    encode_ms = (time.perf_counter() - t0) * 1000.0
+    g_encode_stats.add(view, len(buf), encode_ms)
+    ent = (buf, encode_ms)
+    g_image_cache.put(key, ent, len(buf))
+    return ent
 
-def generate_still_image_as_base64(latid:int, h5obj:h5py.File) -> str:
+def get_event_still_image(latid:int, h5obj:h5py.File) -> tuple[str,float]|None:
     row = g_evlist_df[g_evlist_df["event_id"] == latid].iloc[0]
     fname = row["file"]
     avi_path = find_avi_from_filename(fname)
-    #print(f"avi_path: {avi_path}")
     if avi_path is None:
-        return
+        return None
     dat = row["dat"]
-    #print(avi_path)
-    #print(type(dat))
-    #print(dat)
-
     avi_time_sec = convert_to_avi_time(dat, h5obj, avi_path)
-    b64img = extract_still_image_as_base64(avi_path, avi_time_sec)
-    return b64img
+    return avi_path, avi_time_sec
+
+def get_still_image_etag(avi_path:str, avi_time_sec:float, view:str) -> str:
+    mtime_ns, size = get_file_stamp(avi_path)
+    enc = CONF.image_encodings[view]
+    return hashlib.sha1(f"{avi_path}:{mtime_ns}:{size}:{avi_time_sec:.6f}:{enc}".encode()).hexdigest()[:20]
+
+def generate_still_image_url(avi_path:str, avi_time_sec:float, view:str="webcam") -> str:
+    # The URL changes whenever the image would, so the browser may cache it
+    # without revalidation.
+    stem = os.path.splitext(os.path.basename(avi_path))[0]
+    etag = get_still_image_etag(avi_path, avi_time_sec, view)
+    query = urllib.parse.urlencode({"view": view, "v": etag})
+    return app.get_relative_path(f"/frame/{urllib.parse.quote(stem)}/{avi_time_sec:.6f}?{query}")
+
+def get_event_mat_path(latid:int) -> str:
+    row = g_evlist_df[g_evlist_df["event_id"] == latid].iloc[0]
+    return get_mat_path(g_ac.mat_dir, row["file"])
+
+def generate_event_view(latid:int) -> dict:
+    row = g_evlist_df[g_evlist_df["event_id"] == latid].iloc[0]
+    info_text = f'{latid}  {row["file"]}  {row["dat"]}'
+    dat = row["dat"]
+    stime, etime = get_event_window(dat)
+    with open_signal_file(get_event_mat_path(latid)) as h5obj:
+        traces = generate_signal_traces(h5obj, stime, etime, dat)
+        frame = get_event_still_image(latid, h5obj)
+    img_url = generate_still_image_url(*frame) if frame is not None else None
+    t0 = time.perf_counter()
+    traces, payload_bytes = encode_signal_traces(traces, dat)
+    encode_ms = (time.perf_counter() - t0) * 1000.0
+    return {"info": info_text, "img": img_url, "traces": traces, "payload_bytes": payload_bytes,
+            "encode_ms": encode_ms, "frame": frame}
+
+def estimate_event_view_nbytes(view:dict) -> int:
+    return len(view["info"]) + len(view["img"] or "") + view["payload_bytes"]
+
+class EventPrefetcher:
+    # Computes the views of the events around the selected one in background
+    # threads. Scheduling a new neighbourhood cancels queued work for events
+    # that are no longer in it; work that already started runs to completion.
+    def __init__(self, workers:int, max_bytes:int):
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+        self.cache = ByteLRUCache(max_bytes)
+        self.pending:dict[tuple,concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+        self.cancelled = 0
+
+    def _key(self, latid:int) -> tuple:
+        mat_path = get_event_mat_path(latid)
+        return (mat_path, get_file_stamp(mat_path), latid)
+
+    def get(self, latid:int) -> dict:
+        key = self._key(latid)
+        view = self.cache.get(key)
+        if view is not None:
+            return view
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None and future.cancel():
+                # Not started yet, cheaper to compute it here than to wait in the queue
+                del self.pending[key]
+                future = None
+        if future is not None:
+            return future.result()
+        return self._compute(key)
+
+    def _compute(self, key:tuple) -> dict:
+        view = generate_event_view(key[2])
+        self.cache.put(key, view, estimate_event_view_nbytes(view))
+        return view
+
+    def _run(self, key:tuple) -> dict:
+        try:
+            view = self._compute(key)
+            if view["frame"] is not None:
+                encode_still_image(*view["frame"], "webcam")
+            return view
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def schedule(self, latids:list[int]):
+        keys = []
+        for latid in latids:
+            try:
+                keys.append(self._key(latid))
+            except OSError:
+                pass
+        with self.lock:
+            for key, future in list(self.pending.items()):
+                if key not in keys and future.cancel():
+                    del self.pending[key]
+                    self.cancelled += 1
+            for key in keys:
+                if key in self.pending or self.cache.get(key) is not None:
+                    continue
+                future = self.executor.submit(self._run, key)
+                future.add_done_callback(self._report)
+                self.pending[key] = future
+
+    def _report(self, future:concurrent.futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"prefetch: {future.exception()!r}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"pending": len(self.pending), "cancelled": self.cancelled, "cache": self.cache.stats()}
+
+g_prefetcher = EventPrefetcher(CONF.prefetch_workers, CONF.prefetch_cache_bytes)
+
+def get_neighbour_event_ids(table_row:int, radius:int) -> list[int]:
+    # Nearest rows first so they are picked up by the workers first
+    latids = []
+    for d in range(1, radius + 1):
+        for r in (table_row + d, table_row - d):
+            if 0 <= r < len(g_evlist_df):
+                latids.append(int(g_evlist_df.iloc[r]["event_id"]))
+    return latids
+
+def read_overlay_windows(rows:list[int], channel:str, rel_time:np.ndarray) -> tuple[np.ndarray,list[int]]:
+    # Reads channel around the dat time of each event row and resamples it
+    # onto rel_time (seconds from the event). Returns an
+    # (n_events, len(rel_time)) array, NaN where there is no data, and the
+    # rows that failed. Events are grouped by file so each file is opened
+    # once. Files are read one after the other: h5py serializes all HDF5
+    # calls, so threads would not read faster.
+    stacked = np.full((len(rows), len(rel_time)), np.nan)
+    by_file:dict[str,list[int]] = {}
+    for i, row in enumerate(rows):
+        by_file.setdefault(get_mat_path(g_ac.mat_dir, g_evlist_df.iloc[row]["file"]), []).append(i)
+    # Read a little outside the window so zoh/linear have a sample before
+    # the first and after the last point
+    margin = (rel_time[-1] - rel_time[0]) / max(1, len(rel_time) - 1)
+
+    def read_file(mat_path:str, indices:list[int]) -> list[int]:
+        failed = []
+        try:
+            with open_signal_file(mat_path) as mat:
+                for i in indices:
+                    dat = float(g_evlist_df.iloc[rows[i]]["dat"])
+                    try:
+                        t, v = read_channel_window(mat, channel, dat + rel_time[0] - margin, dat + rel_time[-1] + margin)
+                        stacked[i] = resampling.resample(t - dat, v, rel_time, CONF.resample_method)
+                    except (KeyError, ValueError) as e:
+                        print(f"overlay: {mat_path}: {e}")
+                        failed.append(rows[i])
+        except OSError as e:
+            print(f"overlay: {mat_path}: {e}")
+            failed.extend(rows[i] for i in indices)
+        return failed
+
+    failed = []
+    for mat_path, indices in by_file.items():
+        failed.extend(read_file(mat_path, indices))
+    return stacked, failed
+
+def compute_overlay_stats(stacked:np.ndarray) -> dict[str,np.ndarray]:
+    # Column-wise statistics over the events, ignoring missing samples
+    percentiles = sorted({p for band in CONF.overlay_bands for p in band} | {50.0})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+        values = np.nanpercentile(stacked, percentiles, axis=0)
+        stats = {f"p{p:g}": v for p, v in zip(percentiles, values)}
+        stats["mean"] = np.nanmean(stacked, axis=0)
+    stats["count"] = np.sum(~np.isnan(stacked), axis=0)
+    return stats
+
+def generate_overlay_figure(channel:str, rel_time:np.ndarray, stacked:np.ndarray, stats:dict[str,np.ndarray]) -> go.Figure:
+    fig = go.Figure()
+    # All events as one trace separated by NaN, which draws much faster than
+    # one trace per event
+    n_events, n_points = stacked.shape
+    x = np.tile(np.append(rel_time, np.nan), n_events)
+    y = np.hstack([stacked, np.full((n_events, 1), np.nan)]).ravel()
+    t0 = time.perf_counter()
+    (cloud,), nbytes = encode_signal_traces([{"x": x, "y": y, "mode": "lines"}], 0.0)
+    g_figure_stats.add("overlay", nbytes, (time.perf_counter() - t0) * 1000.0)
+    fig.add_trace(go.Scattergl(x=cloud["x"], y=cloud["y"], mode="lines", name=f"events ({n_events})",
+                               line=dict(color="gray", width=1), opacity=0.3, hoverinfo="skip"))
+    for i, (lo, hi) in enumerate(CONF.overlay_bands):
+        color = f"rgba(31, 119, 180, {0.15 + 0.15 * i})"
+        fig.add_trace(go.Scatter(x=rel_time, y=stats[f"p{lo:g}"], mode="lines", line=dict(width=0),
+                                 showlegend=False, hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=rel_time, y=stats[f"p{hi:g}"], mode="lines", line=dict(width=0),
+                                 fill="tonexty", fillcolor=color, name=f"p{lo:g}-p{hi:g}"))
+    fig.add_trace(go.Scatter(x=rel_time, y=stats["p50"], mode="lines", name="median",
+                             line=dict(color="rgb(31, 119, 180)", dash="dash")))
+    fig.add_trace(go.Scatter(x=rel_time, y=stats["mean"], mode="lines", name="mean",
+                             line=dict(color="firebrick", width=2)))
+    fig.add_vline(x=0, line_dash="solid")
+    fig.update_layout(title=channel, xaxis_title="time from event [s]", margin=dict(l=40, r=20, t=40, b=40))
+    return fig
+
+MAT_REQUIRED_GROUPS = ("port1", "port2")
+MANIFEST_VERSION = 1
+
+def get_manifest_paths(mat_dir:str) -> list[str]:
+    # In the mat folder, or in the cache dir if that folder is read-only
+    return [f"{mat_dir}/.matviewer-manifest.json", f"{CONF.cache_dir}/manifests/{get_path_key(mat_dir)}.json"]
+
+def check_mat_file(path:str, stamp:tuple[int,int]) -> dict:
+    entry = {"mtime_ns": stamp[0], "size": stamp[1], "groups_ok": False,
+             "min_time": None, "max_time": None, "error": None}
+    try:
+        with g_h5pool.open(path) as f:
+            missing = [g for g in MAT_REQUIRED_GROUPS if g not in f]
+            entry["groups_ok"] = not missing
+            if g_mat_meta.get(f)["groups"]:
+                entry["min_time"], entry["max_time"] = get_dat_min_max_time(f)
+            if missing:
+                entry["error"] = f"Missing groups: {', '.join(missing)}"
+            elif entry["min_time"] is None:
+                entry["error"] = "No group with a time dataset"
+    except Exception as e:
+        entry["error"] = f"Cannot read: {e}"
+    return entry
+
+class FolderManifest:
+    # Check results of the mat files of a folder by file name, reused while
+    # a file's mtime/size are unchanged
+    def __init__(self, mat_dir:str, files:dict[str,dict]):
+        self.mat_dir = mat_dir
+        self.files = files
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, mat_dir:str) -> "FolderManifest":
+        for path in get_manifest_paths(mat_dir):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get("version") == MANIFEST_VERSION:
+                return cls(mat_dir, data["files"])
+        return cls(mat_dir, {})
+
+    def get(self, name:str, stamp:tuple[int,int]) -> dict|None:
+        with self.lock:
+            entry = self.files.get(name)
+        if entry is not None and (entry["mtime_ns"], entry["size"]) == stamp:
+            return entry
+        return None
+
+    def update(self, name:str, entry:dict):
+        with self.lock:
+            self.files[name] = entry
+
+    def save(self, names:set[str]|None=None):
+        # names, if given, drops entries of files that no longer exist
+        with self.lock:
+            if names is not None:
+                self.files = {k: v for k, v in self.files.items() if k in names}
+            data = json.dumps({"version": MANIFEST_VERSION, "dir": os.path.abspath(self.mat_dir), "files": self.files})
+            for path in get_manifest_paths(self.mat_dir):
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with atomic_write(path) as tmp_path, open(tmp_path, "w") as f:
+                        f.write(data)
+                    return
+                except OSError:
+                    continue
+            print(f"manifest: cannot write a manifest for {self.mat_dir}")
+
+def check_mat_files(mat_dir:str) -> list[dict]:
+    # Checks every mat file of mat_dir in a thread pool, reusing the results
+    # of the folder manifest for unchanged files. Files not checked within
+    # CONF.folder_check_budget_sec are reported as unchecked; checks that are
+    # already running still complete and are added to the manifest, which is
+    # saved again once all of them are done.
+    manifest = FolderManifest.load(mat_dir)
+    stamps = {}
+    with os.scandir(mat_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".mat") and entry.is_file():
+                st = entry.stat()
+                stamps[entry.name] = (st.st_mtime_ns, st.st_size)
+    results = {}
+    futures = {}
+    executor = concurrent.futures.ThreadPoolExecutor(CONF.folder_check_workers, thread_name_prefix="folder-check")
+    for name, stamp in stamps.items():
+        entry = manifest.get(name, stamp)
+        if entry is not None:
+            results[name] = entry
+        else:
+            futures[executor.submit(check_mat_file, f"{mat_dir}/{name}", stamp)] = name
+    done, not_done = concurrent.futures.wait(futures, timeout=CONF.folder_check_budget_sec)
+    executor.shutdown(wait=False, cancel_futures=True)
+    for future in done:
+        results[futures[future]] = future.result()
+        manifest.update(futures[future], results[futures[future]])
+    # Late results are saved together when the last running check finishes
+    late = set(not_done)
+    late_lock = threading.Lock()
+    def add_late(future, name):
+        if not future.cancelled():
+            manifest.update(name, future.result())
+        with late_lock:
+            late.discard(future)
+            if late:
+                return
+        manifest.save()
+    for future in not_done:
+        future.add_done_callback(functools.partial(add_late, name=futures[future]))
+    manifest.save(set(stamps))
+
+    files = []
+    for name in sorted(stamps):
+        entry = results.get(name)
+        if entry is None:
+            files.append({"file": name, "status": "unchecked", "min_time": None, "max_time": None, "error": None})
+        else:
+            files.append({"file": name, "status": "error" if entry["error"] else "ok",
+                          "min_time": entry["min_time"], "max_time": entry["max_time"], "error": entry["error"]})
+    return files
+
+def generate_file_status_table(files:list[dict]) -> html.Div:
+    # Problem files first
+    order = {"error": 0, "unchecked": 1, "ok": 2}
+    rows = [html.Tr([
+        html.Td(f["file"]),
+        html.Td(f["status"], className={"error": "text-danger", "unchecked": "text-warning"}.get(f["status"], "text-success")),
+        html.Td(f"{f['min_time']:.1f} - {f['max_time']:.1f}" if f["min_time"] is not None else ""),
+        html.Td(f["error"] or ""),
+    ]) for f in sorted(files, key=lambda f: (order[f["status"]], f["file"]))]
+    table = dbc.Table([html.Thead(html.Tr([html.Th("File"), html.Th("Status"), html.Th("Time"), html.Th("Error")])),
+                       html.Tbody(rows)], size="sm", className="text-start mb-0")
+    return html.Div(table, style={"max-height": "40vh", "overflow-y": "auto"})
 
 app = dash.Dash(
     __name__,
@@ -277,13 +1102,14 @@ app.layout = dbc.Container([
                 dbc.ModalBody([
                     html.Div([
                         html.I(className="fas fa-check-circle text-success", style={"font-size": "48px", "margin-bottom": "15px"}),
-                        html.Div("Loaded the mat folder")
+                        html.Div("Loaded the mat folder", className="mb-3"),
+                        html.Div(id="modal-settings-apply-success-body"),
                     ], className="text-center")
                 ], className="theme-mordal-body", style={"padding": "30px"}),
                 dbc.ModalFooter(
                     dbc.Button("Close", id="button-settings-apply-success-modal-close", color="success", className="ms-auto"),
                     className="theme-mordal-footer"),
-            ], id="modal-settings-apply-success", is_open=False, centered=True),
+            ], id="modal-settings-apply-success", is_open=False, centered=True, size="lg"),
             dbc.Modal([
                 dbc.ModalHeader([
                     html.I(className="fas fa-exclamation-triangle me-2 text-danger"),
@@ -294,14 +1120,15 @@ app.layout = dbc.Container([
                         html.I(className="fas fa-times-circle text-danger", style={"font-size": "48px", "margin-bottom": "15px"}),
                         html.Div([
                             html.P("Failed to load the mat folder", className="mb-3"),
-                            html.Div(id="modal-settings-apply-error-body", children="An error occurred", className="text-muted")
+                            html.Div(id="modal-settings-apply-error-body", children="An error occurred", className="text-muted mb-3"),
+                            html.Div(id="modal-settings-apply-error-files"),
                         ])
                     ], className="text-center")
                 ], className="theme-mordal-body", style={"padding": "30px"}),
                 dbc.ModalFooter(
                     dbc.Button("Close", id="button-settings-apply-error-modal-close", color="danger", className="ms-auto"),
                     className="theme-mordal-footer"),
-            ], id="modal-settings-apply-error", is_open=False, centered=True),
+            ], id="modal-settings-apply-error", is_open=False, centered=True, size="lg"),
             dcc.Store(id="store-settings-apply-process-started"),
             dcc.Store(id="store-settings-apply-process-result"),
         ]),
@@ -372,16 +1199,30 @@ app.layout = dbc.Container([
                                 dbc.CardBody([
                                     dcc.Graph(
                                         id="graph-analysis-signals",
+                                        figure=generate_figure_skeleton(),
                                         config={
                                             #"staticPlot": True,
                                             "displayModeBar": False,
-                                            "scrollZoom": False,
-                                            "doubleClick": False,
+                                            "scrollZoom": CONF.signal_zoom,
+                                            "doubleClick": "reset" if CONF.signal_zoom else False,
                                             "showTips": True,
                                             "editable": False,
                                         },
                                         style={"height": "calc(100vh - 300px"}
-                                    )
+                                    ),
+                                    dcc.Slider(
+                                        id="slider-analysis-cursor",
+                                        min=-CONF.signal_window_before_sec,
+                                        max=CONF.signal_window_after_sec,
+                                        step=0.01,
+                                        value=0,
+                                        marks={i: f"{i:+d}" for i in range(-int(CONF.signal_window_before_sec), int(CONF.signal_window_after_sec) + 1)},
+                                        updatemode="drag",
+                                    ),
+                                    html.Div([
+                                        html.Span(f"{channel}: --", id=f"span-analysis-cursor-value-{i}", className="me-4")
+                                        for i, channel in enumerate(g_channel_conf.channels())
+                                    ], className="text-muted"),
                                 ])
                             ])
                         ], width=8)
@@ -389,6 +1230,47 @@ app.layout = dbc.Container([
                 ], width=11),
             ])
         ]),
+        dbc.Tab(label="Overlay", tab_id="tab-overlay", children=[
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            dbc.Row([
+                                dbc.Button("Select all", id="button-overlay-select-all", size="sm", outline=True, className="w-auto me-2"),
+                                dbc.Button("Clear", id="button-overlay-clear", size="sm", outline=True, className="w-auto"),
+                            ], className="mb-2 g-0"),
+                            dash_table.DataTable(
+                                id="table-overlay-event-selection",
+                                columns=[{"name": c, "id": c} for c in g_evlist_df.columns],
+                                data=g_evlist_df.to_dict("records"),
+                                row_selectable="multi",
+                                selected_rows=[],
+                                sort_action="native",
+                                filter_action="native",
+                                style_table={"height": "calc(100vh - 330px)", "overflowY": "auto"},
+                            ),
+                        ])
+                    ]),
+                ], width=3),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            dbc.Row([
+                                dbc.Col(dcc.Dropdown(
+                                    id="dropdown-overlay-channel",
+                                    options=g_channel_conf.channels(),
+                                    value=g_channel_conf.channels()[0],
+                                    clearable=False,
+                                ), width=6),
+                                dbc.Col(dbc.Button("Plot", id="button-overlay-plot", className="w-auto"), width="auto"),
+                                dbc.Col(html.P(id="p-overlay-info", className="text-muted mb-0"), className="align-self-center"),
+                            ], className="mb-2"),
+                            dcc.Loading(dcc.Graph(id="graph-overlay", style={"height": "calc(100vh - 330px)"}), type="circle"),
+                        ])
+                    ]),
+                ], width=9),
+            ]),
+        ]),
     ],
     id="tabs-main",
     active_tab="tab-settings"),
@@ -437,9 +1319,6 @@ def check_mat_folder(selection_method:str, job_number:str, folder_type:str, fold
     #print(f"Folder type: {folder_type}")
     #print(f"Folder path: {folder_path}")
 
-    import time
-    time.sleep(0.5)
-
     mat_dir = None
     if selection_method == "by-job-number":
         if not job_number or job_number.strip() == "":
@@ -469,25 +1348,25 @@ def check_mat_folder(selection_method:str, job_number:str, folder_type:str, fold
     if not os.access(mat_dir, os.R_OK):
         return {"success": False, "error": f"Directory is not readable: {mat_dir}"}
 
-    # Check if directory contains .mat files
-    mat_files = [f for f in os.listdir(mat_dir) if f.endswith('.mat')]
-    if not mat_files:
+    # Check all .mat files; fail only if none of them is usable
+    files = check_mat_files(mat_dir)
+    if not files:
         return {"success": False, "error": f"No .mat files found in directory: {mat_dir}"}
-
-    # Check if .mat files are readable
-    for mat_file in mat_files[:5]:  # Check first 5 files only
-        mat_path = os.path.join(mat_dir, mat_file)
-        try:
-            with h5py.File(mat_path, 'r') as f:
-                # Try to access basic structure
-                if 'port1' not in f or 'port2' not in f:
-                    return {"success": False, "error": f"Invalid .mat file structure in: {mat_file}"}
-        except Exception as e:
-            return {"success": False, "error": f"Cannot read .mat file {mat_file}: {str(e)}"}
+    n_errors = sum(f["status"] == "error" for f in files)
+    if n_errors == len(files):
+        return {"success": False, "error": f"None of the {len(files)} .mat files can be used", "files": files}
+    mat_files = [f["file"] for f in files if f["status"] != "error"]
 
     g_ac.mat_dir = mat_dir
+    g_ac.use_local_cache = CONF.local_cache == "always" or (
+        CONF.local_cache == "shared" and selection_method == "by-folder" and folder_type == "shared")
+    g_video_index.refresh(force=True)
+    # Columnar copies are built on first access (open_signal_file)
+    if CONF.build_pyramids:
+        for mat_file in mat_files:
+            g_pyramid_builder.schedule(os.path.join(mat_dir, mat_file))
 
-    return {"success": True, "error": None, "mat_dir": mat_dir, "mat_files": len(mat_files)}
+    return {"success": True, "error": None, "mat_dir": mat_dir, "mat_files": len(files), "files": files}
 
 @app.callback(
     Output("modal-settings-apply-processing", "is_open"),
@@ -533,43 +1412,189 @@ def trigger_check_mat_folder(processing_is_open, selection_method, job_number, f
     Output("modal-settings-apply-success", "is_open", allow_duplicate=True),
     Output("modal-settings-apply-error", "is_open", allow_duplicate=True),
     Output("modal-settings-apply-error-body", "children"),
+    Output("modal-settings-apply-success-body", "children"),
+    Output("modal-settings-apply-error-files", "children"),
     Input("store-settings-apply-process-result", "data"),
     prevent_initial_call=True)
 def handle_check_mat_folder_result(result_data):
     if result_data and "success" in result_data:
+        files = result_data.get("files")
+        table = generate_file_status_table(files) if files else None
         if result_data["success"]:
             # Success: close processing modal, show success modal
-            success_msg = f"Successfully loaded mat folder with {result_data.get('mat_files', 0)} .mat files"
-            return False, True, False, success_msg
+            counts = collections.Counter(f["status"] for f in files)
+            success_msg = f"{len(files)} .mat files: {counts['ok']} ok, {counts['error']} with errors, {counts['unchecked']} not checked yet"
+            return False, True, False, dash.no_update, [html.P(success_msg), table], None
         else:
             # Failure: close processing modal, show error modal
             error_msg = result_data.get("error", "Unknown error occurred")
-            return False, False, True, error_msg
-    return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+            return False, False, True, error_msg, dash.no_update, table
+    return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
 @app.callback(
     Output("p-analysis-trigger-info", "children"),
     Output("img-analysis-webcam", "src"),
     Output("graph-analysis-signals", "figure"),
+    Output("slider-analysis-cursor", "value"),
     #Input("dropdown-analysis-latid", "value"),
     Input("table-analysis-id-selection", "active_cell"),
     prevent_initial_call=True)
 def latid_updated(active):
     if active is None:
-        return dash.no_update, dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
     row = active["row"]
     col = active["column_id"]
     latid = int(g_evlist_df.iloc[row][col])
-    row = g_evlist_df[g_evlist_df["event_id"] == latid].iloc[0]
-    info_text = f'{latid}  {row["file"]}  {row["dat"]}'
+    view = g_prefetcher.get(latid)
+    g_prefetcher.schedule(get_neighbour_event_ids(row, CONF.prefetch_radius))
+    g_figure_stats.add("event", view["payload_bytes"], view["encode_ms"])
+    return view["info"], view["img"], patch_signal_figure(view["traces"], new_event=True), 0
+
+# Moves the cursor line and updates the value readouts in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="analysis", function_name="move_cursor"),
+    Output("graph-analysis-signals", "figure", allow_duplicate=True),
+    [Output(f"span-analysis-cursor-value-{i}", "children") for i in range(len(g_channel_conf.channels()))],
+    Input("slider-analysis-cursor", "value"),
+    State("graph-analysis-signals", "figure"),
+    prevent_initial_call=True)
 
-    stem = os.path.splitext(row["file"])[0]
-    mat_fname = f"{stem}.mat"
-    mat_path = f"{g_ac.mat_dir}/{mat_fname}"
-    h5obj = h5py.File(mat_path)
+@app.callback(
+    Output("graph-analysis-signals", "figure", allow_duplicate=True),
+    Input("graph-analysis-signals", "relayoutData"),
+    State("table-analysis-id-selection", "active_cell"),
+    prevent_initial_call=True)
+def zoom_signal_figure(relayout, active):
+    # Re-reads the visible x range from the mat file and replaces only the
+    # trace data of the figure
+    if not CONF.signal_zoom or not relayout or active is None:
+        return dash.no_update
+    latid = int(g_evlist_df.iloc[active["row"]][active["column_id"]])
+    row = g_evlist_df[g_evlist_df["event_id"] == latid].iloc[0]
     dat = row["dat"]
-    fig = generate_signal_figure(h5obj, dat)
-    b64img = generate_still_image_as_base64(latid, h5obj)
-    return info_text, b64img, fig
+    mat_path = get_event_mat_path(latid)
+    xrange = get_relayout_xrange(relayout)
+    traces = None
+    if xrange is not None:
+        stime, etime = dat + min(xrange), dat + max(xrange)
+        if etime - stime > CONF.signal_zoom_max_span_sec:
+            # Too long to read raw: use the pyramid if it is built, otherwise
+            # read the middle of the range
+            traces = generate_overview_traces(mat_path, stime, etime)
+            if traces is None:
+                if CONF.build_pyramids:
+                    g_pyramid_builder.schedule(mat_path)
+                center = (stime + etime) / 2
+                stime = center - CONF.signal_zoom_max_span_sec / 2
+                etime = center + CONF.signal_zoom_max_span_sec / 2
+    elif any(k.endswith(".autorange") for k in relayout):
+        stime, etime = get_event_window(dat)
+    else:
+        return dash.no_update
+
+    if traces is None:
+        with open_signal_file(mat_path) as mat:
+            traces = generate_signal_traces(mat, stime, etime, dat)
+    t0 = time.perf_counter()
+    traces, payload_bytes = encode_signal_traces(traces, dat)
+    g_figure_stats.add("zoom", payload_bytes, (time.perf_counter() - t0) * 1000.0)
+    return patch_signal_figure(traces)
+
+@app.callback(
+    Output("table-overlay-event-selection", "selected_rows"),
+    Input("button-overlay-select-all", "n_clicks"),
+    Input("button-overlay-clear", "n_clicks"),
+    State("table-overlay-event-selection", "derived_virtual_indices"),
+    prevent_initial_call=True)
+def select_overlay_events(select_n_clicks, clear_n_clicks, visible_indices):
+    # "Select all" selects the rows that pass the table filter
+    if callback_context.triggered_id == "button-overlay-clear":
+        return []
+    return visible_indices if visible_indices is not None else list(range(len(g_evlist_df)))
+
+@app.callback(
+    Output("graph-overlay", "figure"),
+    Output("p-overlay-info", "children"),
+    Input("button-overlay-plot", "n_clicks"),
+    State("table-overlay-event-selection", "selected_rows"),
+    State("dropdown-overlay-channel", "value"),
+    prevent_initial_call=True)
+def plot_overlay(n_clicks, selected_rows, channel):
+    if not selected_rows:
+        return dash.no_update, "No events selected"
+    rows = sorted(selected_rows)
+    rel_time = np.linspace(-CONF.signal_window_before_sec, CONF.signal_window_after_sec, CONF.overlay_points)
+    t0 = time.perf_counter()
+    stacked, failed = read_overlay_windows(rows, channel, rel_time)
+    stats = compute_overlay_stats(stacked)
+    elapsed = time.perf_counter() - t0
+    info = f"{len(rows) - len(failed)} events in {elapsed:.2f} s"
+    if failed:
+        info += f", {len(failed)} failed (event_id {', '.join(str(g_evlist_df.iloc[r]['event_id']) for r in failed[:10])}{', ...' if len(failed) > 10 else ''})"
+    return generate_overlay_figure(channel, rel_time, stacked, stats), info
+
+def send_still_image(avi_path:str, avi_time_sec:float, immutable:bool) -> flask.Response:
+    view = flask.request.args.get("view", "webcam")
+    if view not in CONF.image_encodings:
+        flask.abort(400)
+    etag = get_still_image_etag(avi_path, avi_time_sec, view)
+    if flask.request.if_none_match.contains(etag):
+        resp = flask.Response(status=304)
+    else:
+        ent = encode_still_image(avi_path, avi_time_sec, view)
+        if ent is None:
+            flask.abort(404)
+        buf, encode_ms = ent
+        resp = flask.Response(buf, mimetype=CONF.image_encodings[view].mimetype())
+        resp.headers["Server-Timing"] = f"encode;dur={encode_ms:.2f}"
+    resp.set_etag(etag)
+    if immutable:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 7 * 24 * 3600
+    else:
+        # Depends on the selected mat folder, so always revalidate
+        resp.cache_control.no_cache = True
+    return resp
+
+@app.server.route("/frame/<int:latid>")
+def frame_by_event(latid:int):
+    if not (g_evlist_df["event_id"] == latid).any():
+        flask.abort(404)
+    with open_signal_file(get_event_mat_path(latid)) as h5obj:
+        frame = get_event_still_image(latid, h5obj)
+    if frame is None:
+        flask.abort(404)
+    return send_still_image(*frame, immutable=False)
+
+@app.server.route("/frame/<stem>/<t>")
+def frame_by_time(stem:str, t:str):
+    avi_path = g_video_index.find(stem)
+    try:
+        avi_time_sec = float(t)
+    except ValueError:
+        flask.abort(400)
+    if avi_path is None:
+        flask.abort(404)
+    return send_still_image(avi_path, avi_time_sec, immutable="v" in flask.request.args)
+
+@app.server.route("/debug/cache-stats")
+def cache_stats():
+    return {
+        "h5pool": g_h5pool.stats(),
+        "memmap": g_dataset_mapper.stats(),
+        "mat_meta": g_mat_meta.stats(),
+        "video_index": g_video_index.stats(),
+        "capture_pool": g_capture_pool.stats(),
+        "frame_cache": g_frame_cache.stats(),
+        "image_cache": g_image_cache.stats(),
+        "image_encode": g_encode_stats.stats(),
+        "figure_payload": g_figure_stats.stats(),
+        "expression_cache": g_expr_cache.stats(),
+        "prefetch": g_prefetcher.stats(),
+        "pyramid": g_pyramid_builder.stats(),
+        "columnar": {**g_columnar_builder.stats(), **g_columnar_budget.stats()},
+        "local_files": g_local_files.stats(),
+    }
 
-app.run(host="0.0.0.0", debug=True)
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", debug=True)
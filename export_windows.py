@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Exports the window around every event of the event list for offline
+# analysis, i.e. what the Analysis tab shows for one event at a time.
+#
+#   python export_windows.py OUT [--format parquet|npz] [--rate HZ] ...
+#
+# Work is split by mat file over a process pool so that each file is opened
+# once. Each worker writes its own output:
+#   parquet  OUT/part-<stem>.parquet, together a dataset readable with
+#            pyarrow.dataset / pandas.read_parquet(OUT). Long format:
+#            event_id, file, channel, time (from dat), value
+#   npz      OUT/<event_id>.npz with event_id, event_file, dat and per channel
+#            "<channel>" and "time:<channel>" (or a single "time" with --rate)
+# Without --rate every channel keeps its own port's samples; with --rate all
+# channels are resampled onto one uniform timebase.
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import matsignals as ms
+import resampling
+
+def read_event_columns(mat, dat:float, channels:list[str], before:float, after:float,
+                       rate:float|None, method:str) -> dict[str,tuple[np.ndarray,np.ndarray]]:
+    # channel -> (time from dat, values)
+    if rate is None:
+        columns = {}
+        for channel in channels:
+            t, v = ms.read_channel_window(mat, channel, dat - before, dat + after)
+            columns[channel] = (t - dat, v)
+        return columns
+    rel_time = resampling.make_uniform_timebase(-before, after, rate)
+    # One sample period of margin so that the first and last points have
+    # source samples on both sides
+    margin = 1.0 / rate
+    columns = {}
+    for channel in channels:
+        t, v = ms.read_channel_window(mat, channel, dat - before - margin, dat + after + margin)
+        columns[channel] = (rel_time, resampling.resample(t - dat, v, rel_time, method))
+    return columns
+
+def write_parquet(path:str, fname:str, events:list[tuple[int,dict]]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    event_ids, channels, times, values = [], [], [], []
+    for event_id, columns in events:
+        for channel, (t, v) in columns.items():
+            event_ids.append(np.full(len(t), event_id, dtype=np.int64))
+            channels.append(np.full(len(t), channel, dtype=object))
+            times.append(t.astype(np.float64, copy=False))
+            values.append(v.astype(np.float64, copy=False))
+    n = sum(len(t) for t in times)
+    table = pa.table({
+        "event_id": np.concatenate(event_ids) if n else np.zeros(0, np.int64),
+        "file": pa.DictionaryArray.from_arrays(np.zeros(n, np.int32), [fname]),
+        "channel": pa.array(np.concatenate(channels) if n else [], pa.string()).dictionary_encode(),
+        "time": np.concatenate(times) if n else np.zeros(0),
+        "value": np.concatenate(values) if n else np.zeros(0),
+    })
+    with ms.atomic_write(path) as tmp_path:
+        pq.write_table(table, tmp_path, compression="zstd")
+
+def write_npz(path:str, event_id:int, fname:str, dat:float, columns:dict, rate:float|None):
+    arrays = {"event_id": np.int64(event_id), "event_file": np.str_(fname), "dat": np.float64(dat)}
+    for channel, (t, v) in columns.items():
+        arrays[channel] = v
+        if rate is None:
+            arrays[f"time:{channel}"] = t
+        else:
+            arrays["time"] = t
+    with ms.atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+
+def export_file(mat_path:str, fname:str, events:list[tuple[int,float]], channels:list[str], before:float,
+                after:float, rate:float|None, method:str, fmt:str, out_dir:str) -> dict:
+    # Runs in a worker process
+    t0 = time.perf_counter()
+    result = {"file": fname, "events": 0, "samples": 0, "bytes": 0, "failed": []}
+    try:
+        with ms.open_signal_file(mat_path, build=False) as mat:
+            done = []
+            for event_id, dat in events:
+                try:
+                    columns = read_event_columns(mat, dat, channels, before, after, rate, method)
+                except (KeyError, ValueError) as e:
+                    result["failed"].append((event_id, str(e)))
+                    continue
+                result["events"] += 1
+                result["samples"] += sum(len(v) for _, v in columns.values())
+                if fmt == "npz":
+                    path = f"{out_dir}/{event_id}.npz"
+                    write_npz(path, event_id, fname, dat, columns, rate)
+                    result["bytes"] += os.path.getsize(path)
+                else:
+                    done.append((event_id, columns))
+            if fmt == "parquet" and done:
+                path = f"{out_dir}/part-{os.path.splitext(fname)[0]}.parquet"
+                write_parquet(path, fname, done)
+                result["bytes"] += os.path.getsize(path)
+    except OSError as e:
+        result["failed"].extend((event_id, str(e)) for event_id, _ in events)
+    result["sec"] = time.perf_counter() - t0
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the signal window around every event of the event list.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=("parquet", "npz"), default="parquet")
+    parser.add_argument("--event-list", default=ms.CONF.event_list_path)
+    parser.add_argument("--mat-dir", default=ms.g_ac.mat_dir)
+    parser.add_argument("--channel", action="append", dest="channels",
+                        help="channel or expression to export (repeatable); default: channels.json")
+    parser.add_argument("--before", type=float, default=ms.CONF.signal_window_before_sec, help="seconds before dat")
+    parser.add_argument("--after", type=float, default=ms.CONF.signal_window_after_sec, help="seconds after dat")
+    parser.add_argument("--rate", type=float, help="resample all channels onto this rate [Hz]")
+    parser.add_argument("--method", choices=resampling.RESAMPLE_METHODS, default=ms.CONF.resample_method)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            parser.error("--format parquet needs pyarrow; install it or use --format npz")
+    channels = args.channels or ms.g_channel_conf.channels()
+    for channel in channels:
+        try:
+            ms.get_channel_refs(channel)
+        except ValueError as e:
+            parser.error(str(e))
+    evlist_df = ms.load_event_list(args.event_list)
+    by_file:dict[str,tuple[str,list[tuple[int,float]]]] = {}
+    for row in evlist_df.itertuples():
+        path = ms.get_mat_path(args.mat_dir, row.file)
+        by_file.setdefault(path, (row.file, []))[1].append((int(row.event_id), float(row.dat)))
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    n_events = len(evlist_df)
+    print(f"{n_events} events in {len(by_file)} files, {len(channels)} channels, {args.workers} workers")
+    t0 = time.perf_counter()
+    events = samples = nbytes = 0
+    failed = []
+    # spawn, not fork: HDF5 library state is not fork-safe
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=ctx) as executor:
+        futures = [executor.submit(export_file, path, fname, file_events, channels, args.before, args.after,
+                                   args.rate, args.method, args.format, args.out_dir)
+                   for path, (fname, file_events) in by_file.items()]
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            r = future.result()
+            events += r["events"]
+            samples += r["samples"]
+            nbytes += r["bytes"]
+            failed.extend(r["failed"])
+            elapsed = time.perf_counter() - t0
+            print(f"[{i}/{len(futures)}] {r['file']}: {r['events']} events in {r['sec']:.2f} s"
+                  f" | total {events + len(failed)}/{n_events} events, {events / elapsed:.1f} events/s,"
+                  f" {samples / elapsed / 1e6:.2f} Msamples/s, {nbytes / elapsed / 1e6:.1f} MB/s written", flush=True)
+
+    elapsed = time.perf_counter() - t0
+    print(f"exported {events} events ({samples:,} samples, {nbytes / 1e6:.1f} MB) to {args.out_dir} in {elapsed:.1f} s")
+    for event_id, error in failed:
+        print(f"failed: event_id {event_id}: {error}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Configuration, mat file access, caches and the derived channel expression
+# engine shared by the app (dashsignalyzer.py) and the batch scripts
+# (export_windows.py, convert_columnar.py). Importing this module does not
+# build the app, read the event list or scan the video folder.
+
+import ast
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import json
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import cv2
+import numpy as np
+import pandas as pd
+import h5py
+try:
+    import hdf5plugin  # Blosc/LZ4 filters for the columnar cache
+except ImportError:
+    hdf5plugin = None
+import os
+import resampling
+
+g_script_dir = os.path.dirname(os.path.abspath(__file__))
+
+@dataclasses.dataclass
+class ImageEncoding:
+    fmt:str = "jpeg"               # "jpeg", "webp" or "png"
+    width:int|None = None          # downscale to this width, never upscale
+    interpolation:int = cv2.INTER_AREA
+    quality:int = 90               # jpeg/webp quality
+    png_compression:int = 3
+
+    def mimetype(self) -> str:
+        return f"image/{self.fmt}"
+
+@dataclasses.dataclass
+class Config:
+    event_list_path:str
+    mat_server_dir:str
+    avi_dir:str
+    cache_dir:str
+    channel_config_path:str
+    video_exts:tuple[str,...]
+    max_open_mat_files:int
+    video_idle_timeout_sec:float
+    frame_cache_bytes:int
+    image_cache_bytes:int
+    image_encodings:dict[str,ImageEncoding]
+    prefetch_radius:int
+    prefetch_workers:int
+    prefetch_cache_bytes:int
+    downsample_mode:str
+    trace_point_budget:int
+    signal_window_before_sec:float
+    signal_window_after_sec:float
+    signal_zoom:bool
+    signal_zoom_max_span_sec:float
+    build_pyramids:bool
+    columnar_cache:bool  # read from / build rechunked copies of the mat files in cache_dir
+    columnar_chunk_bytes:int
+    columnar_cache_bytes:int  # least recently used copies are deleted beyond this
+    mmap_datasets:bool  # read contiguous, uncompressed datasets through np.memmap
+    max_mapped_datasets:int
+    figure_transport:str
+    float32_time_tolerance_sec:float
+    float32_value_rtol:float
+    expression_cache_bytes:int
+    resample_method:str  # "zoh", "nearest" or "linear"; aligns operands on different ports
+    overlay_points:int
+    overlay_bands:tuple[tuple[float,float],...]
+    local_cache:str  # "shared", "always" or "never"; see LocalFileCache
+    local_cache_dir:str
+    local_cache_bytes:int
+    local_cache_workers:int
+    folder_check_workers:int
+    folder_check_budget_sec:float
+
+CONF = Config(
+    event_list_path="./event-list.xlsx",
+    mat_server_dir=f"{g_script_dir}/server-out",
+    avi_dir=f"{g_script_dir}/avi",
+    cache_dir=f"{g_script_dir}/cache",
+    channel_config_path=f"{g_script_dir}/channels.json",
+    video_exts=(".avi", ".mp4", ".mkv", ".mov"),
+    max_open_mat_files=16,
+    video_idle_timeout_sec=120.0,
+    frame_cache_bytes=256*1024*1024,
+    image_cache_bytes=64*1024*1024,
+    image_encodings={
+        # The webcam card is about a third of the screen wide
+        "webcam": ImageEncoding(fmt="jpeg", width=640, quality=80),
+        "full": ImageEncoding(fmt="jpeg", quality=95),
+    },
+    prefetch_radius=2,
+    prefetch_workers=2,
+    prefetch_cache_bytes=128*1024*1024,
+    downsample_mode="minmax",  # "minmax", "lttb" or "none"
+    trace_point_budget=2000,
+    signal_window_before_sec=3.0,
+    signal_window_after_sec=2.0,
+    signal_zoom=True,
+    signal_zoom_max_span_sec=60.0,
+    build_pyramids=True,
+    columnar_cache=True,
+    columnar_chunk_bytes=16*1024,  # ~2 s of a 1 kHz float64 channel
+    columnar_cache_bytes=20*1024*1024*1024,
+    mmap_datasets=True,
+    max_mapped_datasets=1024,
+    figure_transport="float32",  # "float32", "float64" or "json"
+    float32_time_tolerance_sec=1e-6,
+    float32_value_rtol=1e-5,
+    expression_cache_bytes=64*1024*1024,
+    resample_method="zoh",
+    overlay_points=1000,
+    overlay_bands=((5.0, 95.0), (25.0, 75.0)),  # percentile envelopes, outermost first
+    local_cache="shared",  # copy files locally when the mat folder is applied as a shared folder
+    local_cache_dir=f"{g_script_dir}/cache/local-files",
+    local_cache_bytes=20*1024*1024*1024,
+    local_cache_workers=2,
+    folder_check_workers=8,
+    folder_check_budget_sec=10.0,  # files not checked by then are reported as unchecked
+)
+
+@dataclasses.dataclass
+class AppContext:
+    mat_dir:str
+    use_local_cache:bool = CONF.local_cache == "always"
+
+g_ac = AppContext(mat_dir=f"{CONF.mat_server_dir}/11000")
+
+class H5FilePool:
+    # Keeps mat files open between callbacks. Handles are keyed by path and
+    # reopened when the file's mtime/size changes. Least recently used idle
+    # handles are closed when more than max_open files are open.
+    def __init__(self, max_open:int):
+        self.max_open = max_open
+        self.entries:collections.OrderedDict[str,list] = collections.OrderedDict()  # path -> [stamp, h5obj, users]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextlib.contextmanager
+    def open(self, path:str):
+        ent = self._acquire(path)
+        try:
+            yield ent[1]
+        finally:
+            with self.lock:
+                ent[2] -= 1
+                if self.entries.get(path) is not ent and ent[2] == 0:
+                    ent[1].close()
+                self._evict()
+
+    def _acquire(self, path:str) -> list:
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            ent = self.entries.get(path)
+            if ent is not None and ent[0] == stamp and ent[1].id.valid:
+                self.hits += 1
+                self.entries.move_to_end(path)
+            else:
+                if ent is not None:
+                    self._discard(path)
+                self.misses += 1
+                ent = [stamp, h5py.File(path, "r"), 0]
+                self.entries[path] = ent
+            ent[2] += 1
+            self._evict()
+            return ent
+
+    def _discard(self, path:str):
+        ent = self.entries.pop(path)
+        if ent[2] == 0:
+            ent[1].close()
+        # Otherwise the last user closes it on release
+        g_dataset_mapper.drop(path)
+
+    def _evict(self):
+        for path in list(self.entries.keys()):
+            if len(self.entries) <= self.max_open:
+                break
+            if self.entries[path][2] == 0:
+                self._discard(path)
+                self.evictions += 1
+
+    def close_all(self):
+        with self.lock:
+            for path in list(self.entries.keys()):
+                self._discard(path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"open": len(self.entries), "max_open": self.max_open,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+g_h5pool = H5FilePool(CONF.max_open_mat_files)
+
+def get_file_stamp(path:str) -> tuple[int,int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def get_path_key(path:str) -> str:
+    # File name for derived or copied files of path in a cache directory
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+
+def get_tmp_path(path:str) -> str:
+    # Where path is written before it is moved into place; unique per
+    # process and thread
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def remove_quietly(path:str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+@contextlib.contextmanager
+def atomic_write(path:str):
+    # Yields the tmp path to write; it replaces path if the block succeeds
+    # and is deleted if it raises, so no partial or stray file is left
+    tmp_path = get_tmp_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+class MatMetaIndex:
+    # Per mat file summary (time bounds, sample count, median dt and dataset
+    # layout of every port group). Kept in memory and persisted to SQLite,
+    # keyed by path and invalidated by mtime/size.
+    VERSION = 1
+
+    def __init__(self, db_path:str):
+        self.db_path = db_path
+        self.entries:dict[str,tuple[tuple[int,int],dict]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.builds = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS mat_meta (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, version INTEGER, meta TEXT)")
+        return conn
+
+    def get(self, h5obj:h5py.File) -> dict:
+        path = os.path.abspath(h5obj.filename)
+        stamp = get_file_stamp(path)
+        with self.lock:
+            ent = self.entries.get(path)
+            if ent is not None and ent[0] == stamp:
+                self.hits += 1
+                return ent[1]
+        meta = self._load(path, stamp)
+        if meta is None:
+            meta = build_mat_meta(h5obj)
+            self._store(path, stamp, meta)
+            self.builds += 1
+        else:
+            self.db_hits += 1
+        with self.lock:
+            self.entries[path] = (stamp, meta)
+        return meta
+
+    def peek(self, path:str) -> dict|None:
+        # As get without opening the file; None if it has not been indexed
+        path = os.path.abspath(path)
+        try:
+            stamp = get_file_stamp(path)
+        except OSError:
+            return None
+        with self.lock:
+            ent = self.entries.get(path)
+            if ent is not None and ent[0] == stamp:
+                self.hits += 1
+                return ent[1]
+        meta = self._load(path, stamp)
+        if meta is not None:
+            self.db_hits += 1
+            with self.lock:
+                self.entries[path] = (stamp, meta)
+        return meta
+
+    def _load(self, path:str, stamp:tuple[int,int]) -> dict|None:
+        try:
+            with contextlib.closing(self._connect()) as conn:
+                row = conn.execute("SELECT mtime_ns, size, version, meta FROM mat_meta WHERE path = ?", (path,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"mat meta index: {e}")
+            return None
+        if row is None or (row[0], row[1]) != stamp or row[2] != self.VERSION:
+            return None
+        return json.loads(row[3])
+
+    def _store(self, path:str, stamp:tuple[int,int], meta:dict):
+        try:
+            with contextlib.closing(self._connect()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO mat_meta VALUES (?, ?, ?, ?, ?)",
+                             (path, stamp[0], stamp[1], self.VERSION, json.dumps(meta)))
+        except sqlite3.Error as e:
+            print(f"mat meta index: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"files": len(self.entries), "hits": self.hits, "db_hits": self.db_hits, "builds": self.builds}
+
+def build_mat_meta(h5obj:h5py.File) -> dict:
+    groups = {}
+    for k in h5obj.keys():
+        group = h5obj[k]
+        if not isinstance(group, h5py.Group) or "time" not in group:
+            continue
+        time = group["time"]
+        n = time.shape[0]
+        if n == 0:
+            continue
+        # The median dt is taken from the head of the recording so that
+        # building the index does not read the whole time dataset.
+        head = time[:min(n, 65536)]
+        dt = float(np.median(np.diff(head))) if len(head) > 1 else None
+        datasets = {}
+        for name, d in group.items():
+            if isinstance(d, h5py.Dataset):
+                datasets[name] = {
+                    "dtype": d.dtype.str,
+                    "shape": list(d.shape),
+                    "chunks": list(d.chunks) if d.chunks else None,
+                    "compression": d.compression,
+                }
+        groups[k] = {
+            "min_time": float(time[0]),
+            "max_time": float(time[n-1]),
+            "count": n,
+            "median_dt": dt,
+            "datasets": datasets,
+        }
+    return {"groups": groups}
+
+g_mat_meta = MatMetaIndex(f"{CONF.cache_dir}/mat-meta.sqlite")
+
+class DatasetMapper:
+    # np.memmap views of contiguous, uncompressed datasets at their offset in
+    # the file, so slicing them is a page cache read without HDF5 calls or
+    # copies. Chunked, compressed or otherwise filtered datasets are returned
+    # as is. Keyed by file, mtime/size and dataset name; least recently used
+    # maps are dropped beyond max_maps. The maps of a file are dropped when
+    # its stamp changes and when it is closed or deleted (drop()), so they do
+    # not keep replaced or deleted files on disk.
+    def __init__(self, max_maps:int):
+        self.max_maps = max_maps
+        self.maps:collections.OrderedDict[tuple,np.ndarray|None] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.mapped = 0
+        self.fallbacks = 0
+
+    def get(self, d:h5py.Dataset, stamp:tuple[int,int]) -> h5py.Dataset|np.ndarray:
+        if not CONF.mmap_datasets:
+            return d
+        filename = os.path.abspath(d.file.filename)
+        key = (filename, stamp, d.name)
+        with self.lock:
+            if key in self.maps:
+                self.maps.move_to_end(key)
+                m = self.maps[key]
+                if m is None:
+                    self.fallbacks += 1
+                    return d
+                self.mapped += 1
+                return m
+        m = self._map(d)
+        with self.lock:
+            self._drop(filename, stamp)
+            self.maps[key] = m
+            while len(self.maps) > self.max_maps:
+                self.maps.popitem(last=False)
+            if m is None:
+                self.fallbacks += 1
+                return d
+            self.mapped += 1
+            return m
+
+    def drop(self, filename:str):
+        with self.lock:
+            self._drop(os.path.abspath(filename))
+
+    def _drop(self, filename:str, keep_stamp:tuple[int,int]|None=None):
+        # Called with self.lock held
+        for key in [k for k in self.maps if k[0] == filename and k[1] != keep_stamp]:
+            del self.maps[key]
+
+    def _map(self, d:h5py.Dataset) -> np.ndarray|None:
+        if d.size == 0 or d.dtype.kind not in "fiub" or d.dtype.hasobject:
+            return None
+        dcpl = d.id.get_create_plist()
+        if (dcpl.get_layout() != h5py.h5d.CONTIGUOUS or dcpl.get_nfilters() != 0
+                or dcpl.get_external_count() != 0):
+            return None
+        # Storage is not allocated when nothing was written (all fill value)
+        nbytes = d.size * d.dtype.itemsize
+        offset = d.id.get_offset()
+        if offset is None or d.id.get_storage_size() != nbytes or offset + nbytes > os.path.getsize(d.file.filename):
+            return None
+        return np.memmap(d.file.filename, dtype=d.dtype, mode="r", offset=offset, shape=d.shape)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"datasets": len(self.maps), "mapped_reads": self.mapped, "fallback_reads": self.fallbacks}
+
+g_dataset_mapper = DatasetMapper(CONF.max_mapped_datasets)
+
+class DirectoryBudget:
+    # Keeps the files of a cache directory with the given suffixes within
+    # max_bytes by deleting the least recently used ones first. The last use
+    # is the file's atime, set by touch() (at most every TOUCH_INTERVAL_SEC)
+    # and so kept across restarts without an index; the mtime is left alone
+    # as it is part of the file stamp. Used by the local file cache and the
+    # columnar cache.
+    TOUCH_INTERVAL_SEC = 60.0
+
+    def __init__(self, cache_dir:str, max_bytes:int, suffixes:tuple[str,...]):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffixes = tuple(x.lower() for x in suffixes)
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def touch(self, path:str):
+        try:
+            st = os.stat(path)
+            now = time.time()
+            if now - st.st_atime > self.TOUCH_INTERVAL_SEC:
+                os.utime(path, ns=(int(now * 1e9), st.st_mtime_ns))
+        except OSError:
+            pass
+
+    def _files(self) -> list[tuple[float,int,str]]:
+        # (last use, size, path); tmp files of running writes do not match
+        # the suffixes
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for e in it:
+                    if e.is_file() and e.name.lower().endswith(self.suffixes):
+                        st = e.stat()
+                        files.append((st.st_atime, st.st_size, e.path))
+        except FileNotFoundError:
+            pass
+        return files
+
+    def make_room(self, nbytes:int) -> list[str]:
+        # Deletes least recently used files until nbytes more fit and returns
+        # their paths. Files that cannot be deleted, e.g. because they are
+        # open on Windows, are kept.
+        deleted = []
+        with self.lock:
+            files = sorted(self._files())
+            used = sum(f[1] for f in files)
+            for _, size, path in files:
+                if used + nbytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"{self.cache_dir}: {e}")
+                    continue
+                used -= size
+                deleted.append(path)
+                self.evictions += 1
+        for path in deleted:
+            g_dataset_mapper.drop(path)
+        return deleted
+
+    def stats(self) -> dict:
+        files = self._files()
+        with self.lock:
+            return {"files": len(files), "bytes": sum(f[1] for f in files), "max_bytes": self.max_bytes,
+                    "evictions": self.evictions}
+
+class LocalFileCache:
+    # Read-through copies of mat and video files from network shares in a
+    # local directory. get() returns the local copy if its source still has
+    # the same mtime/size; otherwise it starts copying the file in the
+    # background and returns None, so the first access reads from the share.
+    # Least recently used copies are deleted beyond max_bytes
+    # (DirectoryBudget). The index is kept in SQLite so copies survive
+    # restarts.
+    def __init__(self, cache_dir:str, max_bytes:int, workers:int, suffixes:tuple[str,...]):
+        self.cache_dir = cache_dir
+        self.db_path = f"{cache_dir}/index.sqlite"
+        self.max_bytes = max_bytes
+        self.budget = DirectoryBudget(cache_dir, max_bytes, suffixes)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="local-files")
+        self.entries:dict[str,dict]|None = None  # source path -> row, loaded on first use
+        self.pending:set[str] = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.copies = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS local_copies (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, local_path TEXT)")
+        return conn
+
+    def _execute(self, sql:str, params:tuple=()) -> list:
+        try:
+            with contextlib.closing(self._connect()) as conn, conn:
+                return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"local file cache: {e}")
+            return []
+
+    def _load(self):
+        # Called with self.lock held
+        if self.entries is None:
+            rows = self._execute("SELECT path, mtime_ns, size, local_path FROM local_copies")
+            self.entries = {os.path.abspath(r[0]): {"stamp": (r[1], r[2]), "local_path": r[3]}
+                            for r in rows if os.path.exists(r[3])}
+
+    def get(self, path:str, copy:bool=True) -> str|None:
+        # copy=False only looks up an existing copy. Entries are keyed by
+        # absolute path, like the local file names.
+        path = os.path.abspath(path)
+        try:
+            stamp = get_file_stamp(path)
+        except OSError:
+            return None
+        with self.lock:
+            self._load()
+            ent = self.entries.get(path)
+            if ent is not None and not os.path.exists(ent["local_path"]):
+                # Deleted behind our back
+                del self.entries[path]
+                ent = None
+            if ent is not None and ent["stamp"] == stamp:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if copy and path not in self.pending and stamp[1] <= self.max_bytes:
+                    self.pending.add(path)
+                    self.executor.submit(self._copy, path)
+        if ent is None or ent["stamp"] != stamp:
+            return None
+        self.budget.touch(ent["local_path"])
+        return ent["local_path"]
+
+    def _copy(self, path:str):
+        try:
+            stamp = get_file_stamp(path)
+            local_path = f"{self.cache_dir}/{get_path_key(path)}{os.path.splitext(path)[1]}"
+            self._make_room(stamp[1], path)
+            tmp_path = get_tmp_path(local_path)
+            try:
+                shutil.copyfile(path, tmp_path)
+                if get_file_stamp(path) != stamp:
+                    # Modified while copying
+                    remove_quietly(tmp_path)
+                    return
+                os.replace(tmp_path, local_path)
+            except BaseException:
+                remove_quietly(tmp_path)
+                raise
+            with self.lock:
+                self.entries[path] = {"stamp": stamp, "local_path": local_path}
+                self.copies += 1
+            self._execute("INSERT OR REPLACE INTO local_copies VALUES (?, ?, ?, ?)",
+                          (path, stamp[0], stamp[1], local_path))
+        except OSError as e:
+            print(f"local file cache: {path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def _make_room(self, nbytes:int, path:str):
+        # Drops the outdated copy of path, then lets the budget delete least
+        # recently used copies until nbytes more fit
+        with self.lock:
+            old = self.entries.pop(path, None)
+        if old is not None:
+            remove_quietly(old["local_path"])
+            g_dataset_mapper.drop(old["local_path"])
+            self._execute("DELETE FROM local_copies WHERE path = ?", (path,))
+        deleted = set(self.budget.make_room(nbytes))
+        if not deleted:
+            return
+        with self.lock:
+            victims = [p for p, ent in self.entries.items() if ent["local_path"] in deleted]
+            for p in victims:
+                del self.entries[p]
+        for p in victims:
+            self._execute("DELETE FROM local_copies WHERE path = ?", (p,))
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.entries or {}
+            return {"enabled": g_ac.use_local_cache, "files": len(entries),
+                    "bytes": sum(e["stamp"][1] for e in entries.values()), "max_bytes": self.max_bytes,
+                    "pending": len(self.pending), "hits": self.hits, "misses": self.misses,
+                    "copies": self.copies, "evictions": self.budget.evictions}
+
+g_local_files = LocalFileCache(CONF.local_cache_dir, CONF.local_cache_bytes, CONF.local_cache_workers,
+                               (".mat",) + CONF.video_exts)
+
+def resolve_local_copy(path:str, copy:bool=True) -> str:
+    # The local copy of path when the local cache is in use and has it
+    if not g_ac.use_local_cache:
+        return path
+    return g_local_files.get(path, copy) or path
+
+def get_signal_by_path(d, path:str):
+    keys = path.split(".")
+    v = d
+    for k in keys:
+        v = v[k]
+    return v
+
+def searchsorted_dataset(time:h5py.Dataset|np.ndarray, value:float, side:str="left", bounds:tuple[float,float]|None=None) -> int:
+    # Same result as np.searchsorted(time[()], value, side) without reading
+    # the whole dataset. The first guess assumes a uniform timebase; if the
+    # value is not in the block around the guess, bisect on block boundaries
+    # so each probe touches one HDF5 chunk, then search inside the last block.
+    # bounds, if given, are the first and last time values.
+    if isinstance(time, np.ndarray):
+        return int(np.searchsorted(time, value, side=side))
+    n = time.shape[0]
+    if n == 0:
+        return 0
+    block = time.chunks[0] if time.chunks else 4096
+    def after(v) -> bool:
+        return v >= value if side == "left" else v > value
+    t0, t1 = bounds if bounds is not None else (time[0], time[n-1])
+    if after(t0):
+        return 0
+    if not after(t1):
+        return n
+    lo = 1
+    hi = n - 1
+
+    if t1 > t0:
+        guess = int((value - t0) / (t1 - t0) * (n - 1))
+        s = min(max(guess // block * block, lo), hi)
+        e = min(s + block, hi)
+        buf = time[s:e]
+        idx = int(np.searchsorted(buf, value, side=side))
+        if 0 < idx < len(buf):
+            return s + idx
+        if idx == 0:
+            hi = s
+        else:
+            lo = e
+
+    while hi - lo > block:
+        mid = lo + (hi - lo) // 2
+        aligned = mid // block * block
+        if aligned > lo:
+            mid = aligned
+        if after(time[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo + int(np.searchsorted(time[lo:hi], value, side=side))
+
+def get_index_range(time:h5py.Dataset|np.ndarray, stime:float, etime:float, bounds:tuple[float,float]|None=None) -> range:
+    sidx = searchsorted_dataset(time, stime, bounds=bounds)
+    eidx = searchsorted_dataset(time, etime, bounds=bounds)
+    return range(sidx, eidx)
+
+def read_window(h5obj:h5py.File, path:str, stime:float, etime:float, channels:list[str],
+                pad:int=0) -> dict[str,np.ndarray]:
+    # Reads [stime, etime) of the time dataset and the given channels of the
+    # group at path, each as a single contiguous hyperslab, plus pad samples
+    # on each side. Memory-mapped datasets are returned as read-only views
+    # of the map.
+    group = get_signal_by_path(h5obj, path)
+    gmeta = g_mat_meta.get(h5obj)["groups"].get(path)
+    bounds = (gmeta["min_time"], gmeta["max_time"]) if gmeta else None
+    stamp = get_file_stamp(h5obj.filename)
+    time = g_dataset_mapper.get(group["time"], stamp)
+    r = get_index_range(time, stime, etime, bounds)
+    sel = slice(max(r.start - pad, 0), min(r.stop + pad, time.shape[0]))
+    window = {"time": time[sel]}
+    for ch in channels:
+        window[ch] = g_dataset_mapper.get(group[ch], stamp)[sel]
+    return window
+
+class ByteLRUCache:
+    # LRU cache bounded by the total size of the stored values.
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self.entries:collections.OrderedDict = collections.OrderedDict()  # key -> (value, nbytes)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            ent = self.entries.get(key)
+            if ent is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return ent[0]
+
+    def put(self, key, value, nbytes:int):
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, n) = self.entries.popitem(last=False)
+                self.nbytes -= n
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.nbytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+g_expr_cache = ByteLRUCache(CONF.expression_cache_bytes)
+
+PYRAMID_VERSION = 2
+PYRAMID_FACTOR = 8
+PYRAMID_MIN_BUCKETS = 64
+PYRAMID_READ_BLOCK = PYRAMID_FACTOR ** 6
+
+def get_pyramid_paths(mat_path:str) -> list[str]:
+    # Next to the mat file, or in the cache dir if that folder is read-only
+    return [f"{os.path.splitext(mat_path)[0]}.pyr.h5", f"{CONF.cache_dir}/pyramid/{get_path_key(mat_path)}.h5"]
+
+def get_pyramid_first_level(median_dt:float|None) -> int:
+    # The finest level read_overview can choose: it is only used for spans
+    # over signal_zoom_max_span_sec with at most trace_point_budget // 2
+    # buckets, so finer levels would never be read
+    if not median_dt or median_dt <= 0:
+        return 1
+    bucket = CONF.signal_zoom_max_span_sec / median_dt / (CONF.trace_point_budget // 2)
+    level = 1
+    while PYRAMID_FACTOR ** level < bucket:
+        level += 1
+    return level
+
+def reduce_buckets(mn:np.ndarray, mx:np.ndarray, sm:np.ndarray, cnt:np.ndarray,
+                   factor:int=PYRAMID_FACTOR) -> tuple[np.ndarray,...]:
+    # Combines every factor consecutive buckets, NaN samples ignored
+    nb = -(-len(mn) // factor)
+    pad = nb * factor - len(mn)
+    def fold(a, fill):
+        return np.concatenate([a, np.full(pad, fill, a.dtype)]).reshape(nb, factor)
+    return (np.fmin.reduce(fold(mn, np.nan), axis=1), np.fmax.reduce(fold(mx, np.nan), axis=1),
+            fold(sm, 0.0).sum(axis=1), fold(cnt, 0).sum(axis=1))
+
+def write_dataset_pyramid(ds:h5py.Dataset, out:h5py.Group, first_level:int):
+    # The first level is computed block by block so the dataset is never
+    # fully in memory; the higher levels are computed from the level below.
+    bucket = PYRAMID_FACTOR ** first_level
+    block = bucket * max(1, PYRAMID_READ_BLOCK // bucket)
+    parts = []
+    for s in range(0, ds.shape[0], block):
+        a = ds[s:s+block].astype(np.float64)
+        valid = ~np.isnan(a)
+        parts.append(reduce_buckets(a, a, np.where(valid, a, 0.0), valid.astype(np.int64), bucket))
+    level = tuple(np.concatenate(p) for p in zip(*parts))
+    n = first_level
+    while True:
+        mn, mx, sm, cnt = level
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sm / cnt
+        out.create_dataset(f"L{n}", data=np.column_stack([mn, mx, mean]), compression="gzip")
+        if len(mn) <= PYRAMID_MIN_BUCKETS:
+            break
+        level = reduce_buckets(*level)
+        n += 1
+
+def write_signal_pyramid(h5obj:h5py.File, meta:dict, stamp:tuple[int,int], out:h5py.File):
+    # Writes min/max/mean per bucket of PYRAMID_FACTOR**L samples for every
+    # numeric dataset of every port group, from the group's first readable
+    # level (get_pyramid_first_level) up. Layout: <group>/time/L<n> holds
+    # the time of the first sample of each bucket, <group>/<name>/L<n> the
+    # (min, max, mean) columns; <group>/time has the first level as an
+    # attribute.
+    out.attrs.update({"version": PYRAMID_VERSION, "factor": PYRAMID_FACTOR,
+                      "mtime_ns": stamp[0], "size": stamp[1]})
+    for gname, gmeta in meta["groups"].items():
+        group = h5obj[gname]
+        n = gmeta["count"]
+        first_level = get_pyramid_first_level(gmeta["median_dt"])
+        time_levels = out.create_group(f"{gname}/time")
+        time_levels.attrs["first_level"] = first_level
+        t = group["time"][::PYRAMID_FACTOR ** first_level]
+        level = first_level
+        while True:
+            time_levels.create_dataset(f"L{level}", data=t)
+            if len(t) <= PYRAMID_MIN_BUCKETS:
+                break
+            t = t[::PYRAMID_FACTOR]
+            level += 1
+        for name, dmeta in gmeta["datasets"].items():
+            if name == "time" or dmeta["shape"] != [n] or np.dtype(dmeta["dtype"]).kind not in "fiub":
+                continue
+            write_dataset_pyramid(group[name], out.create_group(f"{gname}/{name}"), first_level)
+
+def build_signal_pyramid(mat_path:str) -> str|None:
+    # Writes the pyramid next to the mat file, or in the cache dir if that
+    # folder is read-only. A partly written file is deleted on failure.
+    stamp = get_file_stamp(mat_path)
+    with open_signal_file(mat_path, build=False) as h5obj:
+        meta = g_mat_meta.get(h5obj)
+        for out_path in get_pyramid_paths(mat_path):
+            tmp_path = get_tmp_path(out_path)
+            try:
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                out = h5py.File(tmp_path, "w")
+            except OSError:
+                continue
+            try:
+                with out:
+                    write_signal_pyramid(h5obj, meta, stamp, out)
+                os.replace(tmp_path, out_path)
+            except BaseException:
+                remove_quietly(tmp_path)
+                raise
+            return out_path
+    return None
+
+class FileBuilder:
+    # Builds missing or outdated derived files (pyramids, columnar copies)
+    # one mat file at a time in the background. find returns the derived
+    # file if it is up to date, build writes it and returns its path, or
+    # None if it did not write one; that version of the mat file is then
+    # not scheduled again.
+    def __init__(self, name:str, find, build):
+        self.name = name
+        self.find = find
+        self.build = build
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=name)
+        self.pending:set[str] = set()
+        self.skipped:dict[str,tuple[int,int]] = {}
+        self.lock = threading.Lock()
+        self.built = 0
+
+    def schedule(self, mat_path:str):
+        try:
+            stamp = get_file_stamp(mat_path)
+        except OSError:
+            return
+        with self.lock:
+            if mat_path in self.pending or self.skipped.get(mat_path) == stamp:
+                return
+            self.pending.add(mat_path)
+        self.executor.submit(self._run, mat_path, stamp)
+
+    def _run(self, mat_path:str, stamp:tuple[int,int]):
+        try:
+            if self.find(mat_path) is None:
+                if self.build(mat_path) is None:
+                    with self.lock:
+                        self.skipped[mat_path] = stamp
+                else:
+                    self.built += 1
+        except Exception as e:
+            print(f"{self.name}: {mat_path}: {e!r}")
+        finally:
+            with self.lock:
+                self.pending.discard(mat_path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"pending": len(self.pending), "built": self.built, "skipped": len(self.skipped)}
+
+def find_signal_pyramid(mat_path:str) -> str|None:
+    stamp = get_file_stamp(mat_path)
+    for path in get_pyramid_paths(mat_path):
+        if not os.path.exists(path):
+            continue
+        try:
+            with g_h5pool.open(path) as pyr:
+                if (pyr.attrs.get("version") == PYRAMID_VERSION
+                        and (pyr.attrs.get("mtime_ns"), pyr.attrs.get("size")) == stamp):
+                    return path
+        except OSError:
+            pass
+    return None
+
+def read_overview(mat_path:str, channel:str, stime:float, etime:float, width:int) -> dict[str,np.ndarray]|None:
+    # Min/max/mean of channel over [stime, etime] from the finest pyramid
+    # level that has at most width buckets in the range. None if the
+    # pyramid has not been built.
+    pyr_path = find_signal_pyramid(mat_path)
+    if pyr_path is None:
+        return None
+    gname, name = channel.rsplit(".", 1)
+    with g_h5pool.open(pyr_path) as pyr:
+        if f"{gname}/{name}" not in pyr:
+            return None
+        time_levels = pyr[gname]["time"]
+        first_level = int(time_levels.attrs["first_level"])
+        chosen = None
+        for level in range(first_level + len(time_levels) - 1, first_level - 1, -1):
+            t = time_levels[f"L{level}"]
+            i0 = max(searchsorted_dataset(t, stime, side="right") - 1, 0)
+            i1 = searchsorted_dataset(t, etime, side="right")
+            if chosen is not None and i1 - i0 > width:
+                break
+            chosen = (level, i0, i1)
+        level, i0, i1 = chosen
+        stats = pyr[gname][name][f"L{level}"][i0:i1]
+        return {
+            "time": time_levels[f"L{level}"][i0:i1],
+            "min": stats[:, 0],
+            "max": stats[:, 1],
+            "mean": stats[:, 2],
+            "level": level,
+        }
+
+g_pyramid_builder = FileBuilder("pyramid", find_signal_pyramid, build_signal_pyramid)
+
+COLUMNAR_VERSION = 1
+
+g_columnar_budget = DirectoryBudget(f"{CONF.cache_dir}/columnar", CONF.columnar_cache_bytes, (".h5",))
+
+def get_columnar_path(mat_path:str) -> str:
+    return f"{CONF.cache_dir}/columnar/{get_path_key(mat_path)}.h5"
+
+def get_columnar_filter(itemsize:int) -> dict:
+    # Blosc/LZ4 with byte shuffle if hdf5plugin is installed, else LZF,
+    # which h5py always has. Both decompress much faster than gzip.
+    if hdf5plugin is not None:
+        return dict(hdf5plugin.Blosc(cname="lz4", clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    return {"compression": "lzf", "shuffle": itemsize > 1}
+
+def needs_columnar_copy(meta:dict, size:int) -> bool:
+    # Whether build_columnar_copy writes a copy of a mat file
+    return size <= CONF.columnar_cache_bytes and (not CONF.mmap_datasets or any(
+        d["chunks"] or d["compression"] for gmeta in meta["groups"].values() for d in gmeta["datasets"].values()))
+
+def build_columnar_copy(mat_path:str) -> str|None:
+    # Rewrites the port groups of a mat file with chunks of about
+    # CONF.columnar_chunk_bytes, so a signal window is one or two chunk
+    # reads. Same layout as the mat file, so it can be read with
+    # read_window as is. Other datasets of the groups are copied unchanged;
+    # objects outside the port groups (#refs# etc.) are dropped.
+    # Returns None without writing a copy when every dataset is contiguous
+    # and uncompressed (memory-mapped reads of the mat file are faster) or
+    # the mat file alone is over CONF.columnar_cache_bytes; otherwise least
+    # recently used copies are deleted to make room for one of its size.
+    # Reads an existing local copy of the mat file but does not start one.
+    stamp = get_file_stamp(mat_path)
+    if stamp[1] > CONF.columnar_cache_bytes:
+        return None
+    out_path = get_columnar_path(mat_path)
+    with g_h5pool.open(resolve_local_copy(mat_path, copy=False)) as h5obj:
+        meta = g_mat_meta.get(h5obj)
+        if not needs_columnar_copy(meta, stamp[1]):
+            return None
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        g_columnar_budget.make_room(stamp[1])
+        with atomic_write(out_path) as tmp_path, h5py.File(tmp_path, "w") as out:
+            out.attrs.update({"version": COLUMNAR_VERSION, "source": os.path.abspath(mat_path),
+                              "mtime_ns": stamp[0], "size": stamp[1], "blosc": hdf5plugin is not None})
+            for gname, gmeta in meta["groups"].items():
+                group = h5obj[gname]
+                out_group = out.create_group(gname)
+                n = gmeta["count"]
+                for name, d in group.items():
+                    if not isinstance(d, h5py.Dataset):
+                        continue
+                    if d.shape != (n,):
+                        group.copy(d, out_group, name)
+                        continue
+                    chunk = min(n, max(1024, CONF.columnar_chunk_bytes // d.dtype.itemsize))
+                    dst = out_group.create_dataset(name, shape=(n,), dtype=d.dtype, chunks=(chunk,),
+                                                   **get_columnar_filter(d.dtype.itemsize))
+                    # Copy whole chunks at a time so each output chunk is compressed once
+                    block = chunk * max(1, PYRAMID_READ_BLOCK // chunk)
+                    for s in range(0, n, block):
+                        dst[s:s+block] = d[s:s+block]
+    return out_path
+
+def find_columnar_copy(mat_path:str) -> str|None:
+    path = get_columnar_path(mat_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        stamp = get_file_stamp(mat_path)
+        with g_h5pool.open(path) as f:
+            if (f.attrs.get("version") == COLUMNAR_VERSION
+                    and (f.attrs.get("mtime_ns"), f.attrs.get("size")) == stamp
+                    and (hdf5plugin is not None or not f.attrs.get("blosc"))):
+                g_columnar_budget.touch(path)
+                return path
+    except OSError:
+        pass
+    return None
+
+g_columnar_builder = FileBuilder("columnar", find_columnar_copy, build_columnar_copy)
+
+@contextlib.contextmanager
+def open_signal_file(mat_path:str, build:bool=True):
+    # The columnar copy of mat_path if it is up to date, else the mat file
+    # itself or its local copy; a missing or outdated columnar copy is
+    # rebuilt in the background. Files that get a columnar copy, or may get
+    # one because they have not been indexed yet, are not copied locally
+    # too: the columnar copy is already on local disk.
+    path = None
+    local = True
+    if CONF.columnar_cache:
+        path = find_columnar_copy(mat_path)
+        if path is None:
+            meta = g_mat_meta.peek(mat_path)
+            local = meta is not None and not needs_columnar_copy(meta, get_file_stamp(mat_path)[1])
+            if build:
+                g_columnar_builder.schedule(mat_path)
+    with g_h5pool.open(path or (resolve_local_copy(mat_path) if local else mat_path)) as h5obj:
+        yield h5obj
+
+@dataclasses.dataclass
+class Series:
+    time:np.ndarray
+    values:np.ndarray
+    timebase:str  # group whose time dataset this lives on
+
+CHANNEL_PATH_RE = re.compile(r"[A-Za-z_]\w*\.[A-Za-z_]\w*")  # group.dataset
+
+EXPR_FUNCTIONS = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log, "log10": np.log10,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "atan2": np.arctan2, "hypot": np.hypot,
+    "min": np.minimum, "max": np.maximum, "clip": np.clip,
+}
+EXPR_SERIES_FUNCTIONS = ("deriv", "movavg")  # first argument must use a channel
+EXPR_ARITY = {"atan2": 2, "hypot": 2, "min": 2, "max": 2, "clip": 3, "deriv": 1, "movavg": 2}  # others take 1
+EXPR_CONSTANTS = {"pi": np.pi}
+EXPR_BINOPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+               ast.Pow: np.power, ast.Mod: np.mod}
+
+def is_channel_path(channel:str) -> bool:
+    return CHANNEL_PATH_RE.fullmatch(channel) is not None
+
+def get_dotted_name(node:ast.AST) -> str|None:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = get_dotted_name(node.value)
+        return f"{base}.{node.attr}" if base is not None else None
+    return None
+
+@functools.lru_cache(maxsize=256)
+def parse_expression(expr:str) -> tuple[ast.AST,tuple[str,...]]:
+    # Parses a derived channel such as "hypot(port1.dx, port1.dy)" or
+    # "movavg(deriv(port2.c1), 0.1) * 3.6". Returns the tree and the
+    # channels it reads. Anything but numbers, group.dataset channels,
+    # arithmetic and the functions above with their number of arguments is
+    # rejected; movavg's window must be a number.
+    try:
+        tree = ast.parse(expr, mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression: {expr}: {e.msg}") from None
+    refs = []
+    def check(node) -> bool:
+        # Whether node reads a channel, i.e. evaluates to a Series
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return False
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            name = get_dotted_name(node)
+            if name in EXPR_CONSTANTS:
+                return False
+            if name is None or not is_channel_path(name):
+                raise ValueError(f"Invalid expression: {expr}: unknown name {ast.unparse(node)}")
+            if name not in refs:
+                refs.append(name)
+            return True
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return check(node.operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in EXPR_BINOPS:
+            left = check(node.left)
+            return check(node.right) or left
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords
+                and (node.func.id in EXPR_FUNCTIONS or node.func.id in EXPR_SERIES_FUNCTIONS)):
+            fname = node.func.id
+            nargs = EXPR_ARITY.get(fname, 1)
+            if len(node.args) != nargs:
+                raise ValueError(f"Invalid expression: {expr}: {fname} takes {nargs} argument{'s' if nargs > 1 else ''}")
+            uses = [check(arg) for arg in node.args]
+            if fname in EXPR_SERIES_FUNCTIONS and not uses[0]:
+                raise ValueError(f"Invalid expression: {expr}: the first argument of {fname} must use a channel")
+            if fname == "movavg":
+                window = node.args[1]
+                if not (isinstance(window, ast.Constant) and not isinstance(window.value, bool) and window.value > 0):
+                    raise ValueError(f"Invalid expression: {expr}: the window of movavg must be a positive number")
+            return any(uses)
+        raise ValueError(f"Invalid expression: {expr}: {ast.unparse(node)} is not supported")
+    check(tree)
+    return tree, tuple(refs)
+
+def get_channel_refs(channel:str) -> tuple[str,...]:
+    return (channel,) if is_channel_path(channel) else parse_expression(channel)[1]
+
+def align_operands(args:list) -> list:
+    # Series on another timebase than the first Series are resampled onto
+    # it; numbers are passed through
+    ref = next((a for a in args if isinstance(a, Series)), None)
+    out = []
+    for a in args:
+        if not isinstance(a, Series):
+            out.append(a)
+        elif a.timebase == ref.timebase:
+            out.append(a.values)
+        else:
+            out.append(resampling.resample(a.time, a.values, ref.time, CONF.resample_method))
+    return [ref] + out if ref is not None else [None] + out
+
+@functools.lru_cache(maxsize=256)
+def get_expression_margin(expr:str) -> float:
+    # Seconds of data needed on each side of a window so that movavg is
+    # not cut at the window edges: half of each (nested) movavg window
+    def margin(node) -> float:
+        if isinstance(node, ast.Call):
+            m = max((margin(arg) for arg in node.args), default=0.0)
+            return m + float(node.args[1].value) / 2 if node.func.id == "movavg" else m
+        if isinstance(node, ast.UnaryOp):
+            return margin(node.operand)
+        if isinstance(node, ast.BinOp):
+            return max(margin(node.left), margin(node.right))
+        return 0.0
+    return margin(parse_expression(expr)[0])
+
+def moving_average(s:Series, window_sec:float) -> np.ndarray:
+    # Centered mean over window_sec, NaN samples ignored; the window
+    # shrinks at the edges. Same length as s.values.
+    n = len(s.values)
+    if n < 2:
+        return s.values.astype(np.float64)
+    dt = float(np.median(np.diff(s.time)))
+    k = min(n, max(1, int(round(window_sec / dt)))) if dt > 0 else 1
+    v = s.values.astype(np.float64, copy=False)
+    valid = ~np.isnan(v)
+    total = np.concatenate([[0.0], np.cumsum(np.where(valid, v, 0.0))])
+    count = np.concatenate([[0], np.cumsum(valid)])
+    lo = np.clip(np.arange(n) - k // 2, 0, n)
+    hi = np.clip(np.arange(n) - k // 2 + k, 0, n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (total[hi] - total[lo]) / (count[hi] - count[lo])
+
+def evaluate_expression(node:ast.AST, windows:dict[str,dict[str,np.ndarray]]):
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        name = get_dotted_name(node)
+        if name in EXPR_CONSTANTS:
+            return EXPR_CONSTANTS[name]
+        gname, dname = name.rsplit(".", 1)
+        return Series(windows[gname]["time"], windows[gname][dname], gname)
+    if isinstance(node, ast.UnaryOp):
+        v = evaluate_expression(node.operand, windows)
+        if isinstance(node.op, ast.USub):
+            return Series(v.time, -v.values, v.timebase) if isinstance(v, Series) else -v
+        return v
+    if isinstance(node, ast.BinOp):
+        args = [evaluate_expression(node.left, windows), evaluate_expression(node.right, windows)]
+        return apply_function(EXPR_BINOPS[type(node.op)], args)
+    # ast.Call, validated by parse_expression
+    fname = node.func.id
+    args = [evaluate_expression(arg, windows) for arg in node.args]
+    if fname == "deriv":
+        s = args[0]
+        values = np.gradient(s.values.astype(np.float64, copy=False), s.time) if len(s.values) > 1 else np.zeros(len(s.values))
+        return Series(s.time, values, s.timebase)
+    if fname == "movavg":
+        s, window_sec = args
+        return Series(s.time, moving_average(s, window_sec), s.timebase)
+    return apply_function(EXPR_FUNCTIONS[fname], args)
+
+def apply_function(func, args:list):
+    ref, *values = align_operands(args)
+    with np.errstate(all="ignore"):
+        out = func(*values)
+    return Series(ref.time, np.asarray(out), ref.timebase) if ref is not None else out
+
+def trim_window(time:np.ndarray, values:np.ndarray, stime:float, etime:float) -> tuple[np.ndarray,np.ndarray]:
+    r = slice(int(np.searchsorted(time, stime)), int(np.searchsorted(time, etime)))
+    return time[r], values[r]
+
+def get_expr_cache_key(mat:h5py.File, expr:str, stime:float, etime:float) -> tuple:
+    return (mat.filename, get_file_stamp(mat.filename), expr, stime, etime)
+
+def evaluate_derived_channel(mat:h5py.File, expr:str, windows:dict[str,dict[str,np.ndarray]],
+                             stime:float, etime:float) -> Series:
+    # windows are read by read_operand_windows, with margin, so that
+    # operands on other timebases can be resampled up to both ends and
+    # movavg is not cut at them; the result is trimmed to [stime, etime)
+    s = evaluate_expression(parse_expression(expr)[0], windows)
+    if not isinstance(s, Series):
+        raise ValueError(f"Expression does not use any channel: {expr}")
+    s = Series(*trim_window(s.time, s.values, stime, etime), s.timebase)
+    g_expr_cache.put(get_expr_cache_key(mat, expr, stime, etime), s, s.time.nbytes + s.values.nbytes)
+    return s
+
+@dataclasses.dataclass
+class SubplotConfig:
+    title:str
+    channels:list[str]  # "group.dataset" paths or expressions drawn in this subplot
+
+@dataclasses.dataclass
+class ChannelConfig:
+    rows:int
+    cols:int
+    subplots:list[SubplotConfig]  # filled into the grid row by row
+
+    def channels(self) -> list[str]:
+        # One trace per entry, in trace order
+        return [ch for sp in self.subplots for ch in sp.channels]
+
+    def cell(self, i:int) -> tuple[int,int]:
+        return i // self.cols + 1, i % self.cols + 1
+
+def load_channel_config(path:str) -> ChannelConfig:
+    # JSON file such as
+    #   {"cols": 2, "subplots": [{"title": "dx", "channels": ["port1.dx"]}, ...]}
+    # "rows" defaults to what the subplots need and "title" to the channel
+    # names. Without the file the original two channels are shown.
+    if not os.path.exists(path):
+        return ChannelConfig(rows=2, cols=1, subplots=[
+            SubplotConfig(title="port1.dx", channels=["port1.dx"]),
+            SubplotConfig(title="port2.c1", channels=["port2.c1"]),
+        ])
+    with open(path) as f:
+        d = json.load(f)
+    subplots = [SubplotConfig(title=sp.get("title", ", ".join(sp["channels"])), channels=list(sp["channels"]))
+                for sp in d["subplots"]]
+    cols = int(d.get("cols", 1))
+    rows = int(d.get("rows", -(-len(subplots) // cols)))
+    if rows * cols < len(subplots):
+        raise ValueError(f"{path}: {len(subplots)} subplots do not fit in {rows}x{cols}")
+    for ch in (ch for sp in subplots for ch in sp.channels):
+        try:
+            get_channel_refs(ch)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+    return ChannelConfig(rows=rows, cols=cols, subplots=subplots)
+
+g_channel_conf = load_channel_config(CONF.channel_config_path)
+
+def read_operand_windows(mat:h5py.File, groups:dict[str,list[str]], stime:float, etime:float,
+                         margin:float) -> dict[str,dict[str,np.ndarray]]:
+    # Windows of the groups read by expressions: margin seconds (see
+    # get_expression_margin) plus one sample on each side of [stime, etime)
+    return {gname: read_window(mat, gname, stime - margin, etime + margin, names, 1)
+            for gname, names in groups.items()}
+
+def read_channel_window(mat:h5py.File, channel:str, stime:float, etime:float) -> tuple[np.ndarray,np.ndarray]:
+    # time and values of one raw or derived channel
+    if is_channel_path(channel):
+        gname, name = channel.rsplit(".", 1)
+        window = read_window(mat, gname, stime, etime, [name])
+        return window["time"], window[name]
+    s = g_expr_cache.get(get_expr_cache_key(mat, channel, stime, etime))
+    if s is None:
+        groups:dict[str,list[str]] = {}
+        for ref in get_channel_refs(channel):
+            gname, name = ref.rsplit(".", 1)
+            groups.setdefault(gname, []).append(name)
+        windows = read_operand_windows(mat, groups, stime, etime, get_expression_margin(channel))
+        s = evaluate_derived_channel(mat, channel, windows, stime, etime)
+    return s.time, s.values
+
+def load_event_list(path:str) -> pd.DataFrame:
+    df = pd.read_excel(path)
+    missing = [c for c in ("event_id", "file", "dat") if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: missing columns: {', '.join(missing)}")
+    return df
+
+def get_mat_path(mat_dir:str, fname:str) -> str:
+    # Event list rows name the video; the recording has the same stem
+    return f"{mat_dir}/{os.path.splitext(fname)[0]}.mat"
+
+def get_event_window(dat:float) -> tuple[float,float]:
+    return dat - CONF.signal_window_before_sec, dat + CONF.signal_window_after_sec
+
+def get_dat_min_max_time(h5obj:h5py.File) -> tuple[float,float]:
+    max_time = -99999
+    min_time = 99999
+    for gmeta in g_mat_meta.get(h5obj)["groups"].values():
+        min_time = min(gmeta["min_time"], min_time)
+        max_time = max(gmeta["max_time"], max_time)
+    return min_time, max_time
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Resampling of channels recorded on independent sample clocks (port1.time,
+# port2.time, ...) onto a common target timebase. The source index of every
+# target sample is found in one searchsorted pass per source timebase and
+# then applied to every channel sharing that timebase.
+#
+# Methods:
+#   zoh     latest sample at or before the target time (as get_value_at_time
+#           in test05.py); NaN before the first sample
+#   nearest closest sample; NaN outside the source time range
+#   linear  linear interpolation; NaN outside the source time range
+
+import dataclasses
+import time as time_mod
+import numpy as np
+
+RESAMPLE_METHODS = ("zoh", "nearest", "linear")
+
+@dataclasses.dataclass
+class ResamplePlan:
+    index:np.ndarray        # source index per target sample
+    frac:np.ndarray|None    # weight of index+1 for linear, else None
+    valid:np.ndarray|None   # False where the result is NaN; None if all valid
+
+def make_resample_plan(time:np.ndarray, target_time:np.ndarray, method:str="zoh") -> ResamplePlan:
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resample method: {method}")
+    time = np.asarray(time)
+    target_time = np.asarray(target_time)
+    n = len(time)
+    if n == 0:
+        return ResamplePlan(np.zeros(len(target_time), dtype=np.intp), None, np.zeros(len(target_time), dtype=bool))
+    right = np.searchsorted(time, target_time, side="right")
+    if method == "zoh":
+        index = right - 1
+        valid = index >= 0
+        np.maximum(index, 0, out=index)
+        return ResamplePlan(index, None, None if valid.all() else valid)
+    valid = (target_time >= time[0]) & (target_time <= time[-1])
+    valid = None if valid.all() else valid
+    if method == "nearest":
+        # right-1 is the last sample <= target, right the first one after it
+        hi = np.minimum(right, n - 1)
+        lo = np.maximum(right - 1, 0)
+        index = np.where(target_time - time[lo] <= time[hi] - target_time, lo, hi)
+        return ResamplePlan(index, None, valid)
+    if n == 1:
+        return ResamplePlan(np.zeros(len(target_time), dtype=np.intp), np.zeros(len(target_time)), valid)
+    index = np.clip(right - 1, 0, n - 2)
+    t0 = time[index].astype(np.float64, copy=False)
+    dt = time[index + 1] - t0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(dt > 0, (target_time - t0) / dt, 0.0)
+    return ResamplePlan(index, frac, valid)
+
+def apply_resample_plan(plan:ResamplePlan, values:np.ndarray) -> np.ndarray:
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.full(len(plan.index), np.nan)
+    if plan.frac is not None:
+        v0 = values[plan.index].astype(np.float64, copy=False)
+        v1 = values[np.minimum(plan.index + 1, len(values) - 1)]
+        out = v0 + plan.frac * (v1 - v0)
+    else:
+        out = values[plan.index]
+    if plan.valid is not None:
+        out = out.astype(np.float64, copy=False)
+        out[~plan.valid] = np.nan
+    return out
+
+def resample(time:np.ndarray, values:np.ndarray, target_time:np.ndarray, method:str="zoh") -> np.ndarray:
+    return apply_resample_plan(make_resample_plan(time, target_time, method), values)
+
+def resample_window(window:dict[str,np.ndarray], target_time:np.ndarray, method:str="zoh") -> dict[str,np.ndarray]:
+    # window is {"time": ..., channel: ...} as returned by read_window
+    plan = make_resample_plan(window["time"], target_time, method)
+    out = {"time": target_time}
+    for name, values in window.items():
+        if name != "time":
+            out[name] = apply_resample_plan(plan, values)
+    return out
+
+def align_windows(windows:dict[str,dict[str,np.ndarray]], target_time:np.ndarray,
+                  method:str="zoh") -> dict[str,np.ndarray]:
+    # Flattens {group: window} onto target_time as {"time": ..., "group.channel": ...}
+    out = {"time": target_time}
+    for gname, window in windows.items():
+        for name, values in resample_window(window, target_time, method).items():
+            if name != "time":
+                out[f"{gname}.{name}"] = values
+    return out
+
+def make_uniform_timebase(stime:float, etime:float, rate_hz:float) -> np.ndarray:
+    return stime + np.arange(int(np.floor((etime - stime) * rate_hz)) + 1) / rate_hz
+
+def benchmark(n:int=1_000_000, repeat:int=5):
+    rng = np.random.default_rng(0)
+    # Independent jittered source and target clocks over the same ~100 s
+    src_time = np.sort(rng.uniform(0, 100, n))
+    src_values = np.cumsum(rng.normal(size=n)).astype(np.float32)
+    target_time = np.sort(rng.uniform(-1, 101, n))
+
+    def measure(func, repeat=repeat):
+        best = float("inf")
+        for _ in range(repeat):
+            t = time_mod.perf_counter()
+            func()
+            best = min(best, time_mod.perf_counter() - t)
+        return best * 1000
+
+    print(f"source {n:,} samples, target {n:,} samples, best of {repeat}")
+    for method in RESAMPLE_METHODS:
+        ms = measure(lambda: resample(src_time, src_values, target_time, method))
+        print(f"  {method:9s} {ms:8.1f} ms  {n / ms / 1000:6.1f} Msamples/s")
+    ms = measure(lambda: np.interp(target_time, src_time, src_values))
+    print(f"  {'np.interp':9s} {ms:8.1f} ms  (reference for linear)")
+
+    plan = make_resample_plan(src_time, target_time, "zoh")
+    channels = [src_values * k for k in range(8)]
+    ms = measure(lambda: [apply_resample_plan(plan, v) for v in channels])
+    print(f"  8 channels on one timebase, plan reused: {ms:.1f} ms")
+
+    # Per-sample lookup as in test05.py, on a subset
+    m = 10_000
+    def scalar():
+        for t in target_time[:m]:
+            idx = np.searchsorted(src_time, t, side="right") - 1
+            float(src_values[idx]) if idx >= 0 else float("nan")
+    ms = measure(scalar, 1) * n / m
+    print(f"  per-sample zoh loop  ~{ms:8.1f} ms (extrapolated from {m:,})")
+
+if __name__ == "__main__":
+    benchmark()